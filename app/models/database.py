@@ -1,11 +1,32 @@
 import logging
 from pymongo import MongoClient
+from pymongo.write_concern import WriteConcern
+from pymongo.errors import OperationFailure
 from flask import current_app
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional
 import json
 from bson import ObjectId
 
+# Fields needed to rebuild recent conversation context
+CONVERSATION_PROJECTION = {
+    "_id": 0,
+    "message": 1,
+    "message_type": 1,
+    "intent": 1,
+    "timestamp": 1
+}
+
+CONVERSATION_HISTORY_INDEX = [("user_id", 1), ("timestamp", -1)]
+
+CUSTOMER_NAME_INDEX = [("user_id", 1), ("name", 1), ("id", 1)]
+
+INVOICE_PERIOD_INDEX = [("user_id", 1), ("created_at", -1)]
+
+INVOICE_NUMBER_INDEX = [("user_id", 1), ("invoice_number", 1)]
+
+INVOICE_COUNTER_INDEX = [("user_id", 1), ("period", 1)]
+
 class MongoDBManager:
     """MongoDB database manager for Korra Chatbot"""
     
@@ -54,7 +75,7 @@ class MongoDBManager:
         self.collections['conversations'] = self.db.conversations
         self.collections['conversations'].create_index("user_id")
         self.collections['conversations'].create_index("timestamp")
-        self.collections['conversations'].create_index([("user_id", 1), ("timestamp", -1)])
+        self.collections['conversations'].create_index(CONVERSATION_HISTORY_INDEX)
         
         # Business Data Collection
         self.collections['business_data'] = self.db.business_data
@@ -67,6 +88,41 @@ class MongoDBManager:
         self.collections['invoices'].create_index("user_id")
         self.collections['invoices'].create_index("status")
         self.collections['invoices'].create_index("created_at")
+        self.collections['invoices'].create_index(INVOICE_PERIOD_INDEX)
+        self.collections['invoices'].create_index([
+            ("user_id", 1), ("customer_id", 1), ("due_date", 1), ("payment_status", 1), ("status", 1)
+        ])
+        # Invoice listing filters, each sorted newest first
+        self.collections['invoices'].create_index([("user_id", 1), ("status", 1), ("created_at", -1)])
+        self.collections['invoices'].create_index([("user_id", 1), ("payment_status", 1), ("created_at", -1)])
+        self.collections['invoices'].create_index([("user_id", 1), ("customer_id", 1), ("created_at", -1)])
+        self.collections['invoices'].create_index([("user_id", 1), ("due_date", 1), ("payment_status", 1)])
+        # Recurring invoices per user, and those due across all users
+        self.collections['invoices'].create_index([("user_id", 1), ("is_recurring", 1), ("next_invoice_date", 1)])
+        self.collections['invoices'].create_index([("is_recurring", 1), ("next_invoice_date", 1)])
+        self.collections['invoices'].create_index(
+            [("invoice_number", "text"), ("notes", "text"), ("customer.name", "text"), ("customer.company", "text")],
+            default_language="none",
+            name="invoice_text"
+        )
+        try:
+            self.collections['invoices'].create_index(INVOICE_NUMBER_INDEX, unique=True)
+        except OperationFailure as e:
+            # Existing duplicate numbers block the constraint but must not block startup
+            logging.warning(f"Could not create unique invoice number index: {e}")
+        
+        # Per-user monthly counters for invoice numbers
+        self.collections['invoice_counters'] = self.db.invoice_counters
+        self.collections['invoice_counters'].create_index(INVOICE_COUNTER_INDEX, unique=True)
+        
+        # Customers Collection
+        self.collections['customers'] = self.db.customers
+        self.collections['customers'].create_index(CUSTOMER_NAME_INDEX)
+        self.collections['customers'].create_index(
+            [("name", "text"), ("email", "text"), ("company", "text"), ("phone", "text")],
+            weights={"name": 10, "company": 5, "email": 3, "phone": 1},
+            name="customer_text"
+        )
         
         # Analytics Collection (for tracking bot performance)
         self.collections['analytics'] = self.db.analytics
@@ -82,15 +138,16 @@ class MongoDBManager:
             if not self.collections:
                 return False
                 
+            now = datetime.utcnow()
             session_data = {
                 "user_id": user_id,
                 "name": user_data.get('name', ''),
                 "phone_number": user_data.get('phone_number', ''),
-                "last_interaction": datetime.utcnow(),
+                "last_interaction": now,
                 "context": user_data.get('context', {}),
                 "session_count": user_data.get('session_count', 1),
-                "created_at": user_data.get('created_at', datetime.utcnow()),
-                "updated_at": datetime.utcnow()
+                "created_at": user_data.get('created_at', now),
+                "updated_at": now
             }
             
             # Upsert user session
@@ -107,17 +164,18 @@ class MongoDBManager:
             logging.error(f"Error saving user session: {e}")
             return False
     
-    def get_user_session(self, user_id: str) -> Optional[Dict]:
-        """Get user session data"""
+    def get_user_session(self, user_id: str, projection: Dict = None) -> Optional[Dict]:
+        """Get user session data, optionally limited to the projected fields"""
         try:
             if not self.collections:
                 return None
                 
-            session = self.collections['user_sessions'].find_one({"user_id": user_id})
+            session = self.collections['user_sessions'].find_one({"user_id": user_id}, projection)
             
             if session:
                 # Convert ObjectId to string for JSON serialization
-                session['_id'] = str(session['_id'])
+                if '_id' in session:
+                    session['_id'] = str(session['_id'])
                 return session
                 
             return None
@@ -132,13 +190,14 @@ class MongoDBManager:
             if not self.collections:
                 return False
                 
+            now = datetime.utcnow()
             result = self.collections['user_sessions'].update_one(
                 {"user_id": user_id},
                 {
                     "$set": {
                         "context": context_update,
-                        "last_interaction": datetime.utcnow(),
-                        "updated_at": datetime.utcnow()
+                        "last_interaction": now,
+                        "updated_at": now
                     }
                 }
             )
@@ -149,6 +208,35 @@ class MongoDBManager:
             logging.error(f"Error updating user context: {e}")
             return False
     
+    def patch_session_context(self, user_id: str, context_updates: Dict) -> bool:
+        """Set individual context fields for user in a single upsert"""
+        try:
+            if not self.collections:
+                return False
+                
+            now = datetime.utcnow()
+            update_fields = {f"context.{key}": value for key, value in context_updates.items()}
+            update_fields["last_interaction"] = now
+            update_fields["updated_at"] = now
+            
+            self.collections['user_sessions'].update_one(
+                {"user_id": user_id},
+                {
+                    "$set": update_fields,
+                    "$setOnInsert": {
+                        "created_at": now,
+                        "session_count": 1
+                    }
+                },
+                upsert=True
+            )
+            
+            return True
+            
+        except Exception as e:
+            logging.error(f"Error patching session context: {e}")
+            return False
+    
     # Conversation History Management
     def save_conversation(self, user_id: str, message: str, message_type: str, intent: str = None, ai_provider: str = None, metadata: Dict = None) -> bool:
         """Save conversation message"""
@@ -156,6 +244,7 @@ class MongoDBManager:
             if not self.collections:
                 return False
                 
+            now = datetime.utcnow()
             conversation_data = {
                 "user_id": user_id,
                 "message": message,
@@ -163,8 +252,8 @@ class MongoDBManager:
                 "intent": intent,
                 "ai_provider": ai_provider,
                 "metadata": metadata or {},
-                "timestamp": datetime.utcnow(),
-                "session_id": f"{user_id}_{datetime.utcnow().strftime('%Y%m%d')}"
+                "timestamp": now,
+                "session_id": f"{user_id}_{now.strftime('%Y%m%d')}"
             }
             
             result = self.collections['conversations'].insert_one(conversation_data)
@@ -184,14 +273,11 @@ class MongoDBManager:
                 
             conversations = list(
                 self.collections['conversations']
-                .find({"user_id": user_id})
+                .find({"user_id": user_id}, CONVERSATION_PROJECTION)
                 .sort("timestamp", -1)
+                .hint(CONVERSATION_HISTORY_INDEX)
                 .limit(limit)
             )
-            
-            # Convert ObjectIds to strings
-            for conv in conversations:
-                conv['_id'] = str(conv['_id'])
                 
             return conversations[::-1]  # Return in chronological order
             
@@ -220,7 +306,7 @@ class MongoDBManager:
             })
             
             # Get most recent session
-            session = self.get_user_session(user_id)
+            session = self.get_user_session(user_id, {"_id": 0, "created_at": 1, "last_interaction": 1})
             
             # Count by intent (last 30 days)
             thirty_days_ago = datetime.utcnow() - timedelta(days=30)
@@ -313,13 +399,7 @@ class MongoDBManager:
             if not self.collections:
                 return False
                 
-            event_data = {
-                "event_type": event_type,
-                "user_id": user_id,
-                "data": data or {},
-                "timestamp": datetime.utcnow(),
-                "date": datetime.utcnow().strftime('%Y-%m-%d')
-            }
+            event_data = self._build_event(event_type, user_id, data, datetime.utcnow())
             
             result = self.collections['analytics'].insert_one(event_data)
             return True
@@ -328,6 +408,35 @@ class MongoDBManager:
             logging.error(f"Error tracking event: {e}")
             return False
     
+    def bulk_track_events(self, events: List[Dict]) -> bool:
+        """Insert a batch of queued analytics events without waiting for acknowledgement"""
+        try:
+            if not self.collections or not events:
+                return False
+                
+            event_docs = [
+                self._build_event(event['event_type'], event.get('user_id'), event.get('data'), event['timestamp'])
+                for event in events
+            ]
+            
+            analytics = self.collections['analytics'].with_options(write_concern=WriteConcern(w=0))
+            analytics.insert_many(event_docs, ordered=False)
+            return True
+            
+        except Exception as e:
+            logging.error(f"Error tracking events in bulk: {e}")
+            return False
+    
+    def _build_event(self, event_type: str, user_id: Optional[str], data: Optional[Dict], timestamp: datetime) -> Dict:
+        """Build an analytics event document"""
+        return {
+            "event_type": event_type,
+            "user_id": user_id,
+            "data": data or {},
+            "timestamp": timestamp,
+            "date": timestamp.strftime('%Y-%m-%d')
+        }
+    
     def get_daily_stats(self, days: int = 7) -> Dict:
         """Get daily usage statistics"""
         try:
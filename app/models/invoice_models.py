@@ -2,8 +2,12 @@ from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
 from enum import Enum
+import sys
 import uuid
 
+# Slotted dataclasses (Python 3.10+) are smaller and faster to build in bulk
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
 class InvoiceStatus(Enum):
     DRAFT = "draft"
     SENT = "sent"
@@ -25,7 +29,28 @@ class RecurrenceType(Enum):
     QUARTERLY = "quarterly"
     ANNUALLY = "annually"
 
-@dataclass
+# Overdue means past due, not fully paid and not cancelled. The statuses are
+# spelled as $in lists so queries get index bounds instead of $ne scans.
+UNPAID_PAYMENT_STATUSES = [status.value for status in PaymentStatus if status is not PaymentStatus.PAID]
+OPEN_INVOICE_STATUSES = [status.value for status in InvoiceStatus if status is not InvoiceStatus.CANCELLED]
+
+def overdue_filter(now: datetime) -> Dict:
+    """MongoDB query matching overdue invoice documents, same rule as Invoice.is_overdue"""
+    return {
+        "due_date": {"$lt": now},
+        "payment_status": {"$in": UNPAID_PAYMENT_STATUSES},
+        "status": {"$in": OPEN_INVOICE_STATUSES}
+    }
+
+def overdue_expression(now: datetime) -> Dict:
+    """Aggregation expression that is true for overdue invoices, for use in $cond"""
+    return {"$and": [
+        {"$lt": ["$due_date", now]},
+        {"$in": ["$payment_status", UNPAID_PAYMENT_STATUSES]},
+        {"$in": ["$status", OPEN_INVOICE_STATUSES]}
+    ]}
+
+@dataclass(**_SLOTS)
 class Address:
     """Address data structure"""
     street: str = ""
@@ -53,7 +78,7 @@ class Address:
             country=data.get("country", "")
         )
 
-@dataclass
+@dataclass(**_SLOTS)
 class Customer:
     """Customer data structure"""
     id: str = field(default_factory=lambda: str(uuid.uuid4()))
@@ -87,26 +112,39 @@ class Customer:
     
     @classmethod
     def from_dict(cls, data: Dict) -> 'Customer':
+        # Generated defaults are only computed when the stored document lacks a value
+        billing_address = data.get("billing_address")
         customer = cls(
-            id=data.get("id", str(uuid.uuid4())),
+            id=data["id"] if "id" in data else str(uuid.uuid4()),
             name=data.get("name", ""),
             email=data.get("email", ""),
             phone=data.get("phone", ""),
             company=data.get("company", ""),
-            billing_address=Address.from_dict(data.get("billing_address", {})),
+            billing_address=Address.from_dict(billing_address) if billing_address else Address(),
             tax_id=data.get("tax_id", ""),
             payment_terms=data.get("payment_terms", 30),
             notes=data.get("notes", ""),
-            created_at=data.get("created_at", datetime.utcnow()),
-            updated_at=data.get("updated_at", datetime.utcnow())
+            created_at=data["created_at"] if "created_at" in data else datetime.utcnow(),
+            updated_at=data["updated_at"] if "updated_at" in data else datetime.utcnow()
         )
         
         if data.get("shipping_address"):
             customer.shipping_address = Address.from_dict(data["shipping_address"])
             
         return customer
+    
+    @classmethod
+    def from_search_dict(cls, data: Dict) -> 'Customer':
+        """Build a lightweight customer from a search result projection"""
+        return cls(
+            id=data.get("id", ""),
+            name=data.get("name", ""),
+            email=data.get("email", ""),
+            phone=data.get("phone", ""),
+            company=data.get("company", "")
+        )
 
-@dataclass
+@dataclass(**_SLOTS)
 class InvoiceItem:
     """Invoice item data structure"""
     description: str = ""
@@ -164,7 +202,7 @@ class InvoiceItem:
             discount=data.get("discount", 0.0)
         )
 
-@dataclass
+@dataclass(**_SLOTS)
 class Payment:
     """Payment record data structure"""
     id: str = field(default_factory=lambda: str(uuid.uuid4()))
@@ -195,7 +233,7 @@ class Payment:
             notes=data.get("notes", "")
         )
 
-@dataclass
+@dataclass(**_SLOTS)
 class Invoice:
     """Invoice data structure"""
     id: str = field(default_factory=lambda: str(uuid.uuid4()))
@@ -239,6 +277,9 @@ class Invoice:
     sent_at: Optional[datetime] = None
     viewed_at: Optional[datetime] = None
     
+    # Incremented on every save, used to detect concurrent updates
+    version: int = 0
+    
     def calculate_totals(self):
         """Calculate invoice totals from items"""
         self.subtotal = sum(item.subtotal for item in self.items)
@@ -330,7 +371,8 @@ class Invoice:
             "updated_at": self.updated_at,
             "sent_at": self.sent_at,
             "viewed_at": self.viewed_at,
-            "is_overdue": self.is_overdue
+            "is_overdue": self.is_overdue,
+            "version": self.version
         }
     
     @classmethod
@@ -358,7 +400,8 @@ class Invoice:
             created_at=data.get("created_at", datetime.utcnow()),
             updated_at=data.get("updated_at", datetime.utcnow()),
             sent_at=data.get("sent_at"),
-            viewed_at=data.get("viewed_at")
+            viewed_at=data.get("viewed_at"),
+            version=data.get("version", 0)
         )
         
         # Load items
@@ -6,9 +6,62 @@ and analytics tracking with MongoDB integration.
 """
 
 import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
 from typing import Dict, List, Optional
 from datetime import datetime
 
+# Session fields read back from MongoDB; everything else stays server-side
+USER_SESSION_PROJECTION = {
+    '_id': 0,
+    'name': 1,
+    'context': 1,
+    'preferences': 1,
+    'business_context': 1,
+    'last_interaction': 1,
+    'session_count': 1,
+    'created_at': 1,
+    'last_action': 1
+}
+
+# Upper bound on sessions kept in memory when running without MongoDB
+MAX_MEMORY_SESSIONS = 50000
+
+# Analytics events are flushed when a batch fills up or the interval elapses
+EVENT_BATCH_SIZE = 500
+EVENT_FLUSH_INTERVAL = 1.0
+
+
+class SessionCache(OrderedDict):
+    """In-memory session store that evicts the least recently used session"""
+    
+    def __init__(self, maxsize: int = MAX_MEMORY_SESSIONS):
+        super().__init__()
+        self.maxsize = maxsize
+    
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+    
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+    
+    def __setitem__(self, key, value):
+        if key in self:
+            self.move_to_end(key)
+        super().__setitem__(key, value)
+        if len(self) > self.maxsize:
+            evicted_id, _ = self.popitem(last=False)
+            logging.warning(
+                f"In-memory session limit ({self.maxsize}) reached, evicted {evicted_id}; "
+                "configure MongoDB to persist sessions"
+            )
+
 
 class SessionManager:
     """Manages user sessions and conversation history"""
@@ -16,7 +69,12 @@ class SessionManager:
     def __init__(self, db_manager=None):
         self.db_manager = db_manager
         self.db_enabled = False
-        self.user_sessions = {}  # In-memory fallback
+        self.user_sessions = SessionCache()  # In-memory fallback, LRU-bounded
+        
+        # Analytics events are written in batches by a background worker
+        self._event_q = queue.SimpleQueue()
+        self._event_worker = None
+        self._event_worker_lock = threading.Lock()
         
         # Initialize database connection
         if self.db_manager:
@@ -63,7 +121,7 @@ class SessionManager:
         """
         # Try to load from database first
         if self.db_enabled and self.db_manager:
-            session = self.db_manager.get_user_session(user_id)
+            session = self.db_manager.get_user_session(user_id, USER_SESSION_PROJECTION)
             if session:
                 # Update name if changed
                 if session.get('name') != user_name:
@@ -79,11 +137,12 @@ class SessionManager:
     
     def _create_new_session(self, user_id: str, user_name: str) -> Dict:
         """Create a new user session"""
+        now = datetime.utcnow()
         return {
             'user_id': user_id,
             'name': user_name,
-            'created_at': datetime.utcnow(),
-            'last_interaction': datetime.utcnow(),
+            'created_at': now,
+            'last_interaction': now,
             'last_action': None,
             'context': {},
             'session_count': 1,
@@ -126,6 +185,15 @@ class SessionManager:
         Returns:
             Success status
         """
+        # Single $set on the stored document, no read-modify-write round-trip
+        if self.db_enabled and self.db_manager:
+            if self.db_manager.patch_session_context(user_id, context_updates):
+                # Keep any in-memory copy coherent with the stored document
+                cached = self.user_sessions.get(user_id)
+                if cached is not None:
+                    cached['context'].update(context_updates)
+                return True
+        
         session = self.load_user_session(user_id, context_updates.get('name', ''))
         session['context'].update(context_updates)
         return self.save_user_session(user_id, session)
@@ -218,12 +286,51 @@ class SessionManager:
             Success status
         """
         if self.db_enabled and self.db_manager:
-            return self.db_manager.track_event(event_type, user_id, data)
+            self._ensure_event_worker()
+            self._event_q.put_nowait({
+                'event_type': event_type,
+                'user_id': user_id,
+                'data': data,
+                'timestamp': datetime.utcnow()
+            })
+            return True
         
         # Fallback: log event
         logging.info(f"Event: {event_type} for user {user_id}: {data}")
         return True
     
+    def _ensure_event_worker(self):
+        """Start the analytics flush thread on first use"""
+        if self._event_worker is not None:
+            return
+        
+        with self._event_worker_lock:
+            if self._event_worker is None:
+                self._event_worker = threading.Thread(
+                    target=self._flush_events, name="analytics-events", daemon=True
+                )
+                self._event_worker.start()
+    
+    def _flush_events(self):
+        """Drain queued analytics events into MongoDB in batches"""
+        while True:
+            batch = [self._event_q.get()]
+            deadline = time.monotonic() + EVENT_FLUSH_INTERVAL
+            
+            while len(batch) < EVENT_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._event_q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            try:
+                self.db_manager.bulk_track_events(batch)
+            except Exception as e:
+                logging.error(f"Error flushing analytics events: {e}")
+    
     def get_user_preferences(self, user_id: str) -> Dict:
         """Get user preferences and settings"""
         session = self.load_user_session(user_id, '')
@@ -1,14 +1,26 @@
-import pandas as pd
-import numpy as np
+from statistics import fmean
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional
 import logging
 
+try:
+    from .advanced_analytics import create_advanced_analytics
+except ImportError as e:
+    logging.warning(f"Advanced analytics not available: {e}")
+    create_advanced_analytics = None
+
+try:
+    from .sales_models import SalesDataManager
+except ImportError as e:
+    logging.warning(f"Sales data manager not available: {e}")
+    SalesDataManager = None
+
 class CompetitiveIntelligence:
     """Market analysis and competitive intelligence service"""
     
     def __init__(self, db_manager):
         self.db_manager = db_manager
+        self._analytics = None
         # Industry benchmarks (can be updated with real market data)
         self.industry_benchmarks = {
             "retail": {
@@ -22,7 +34,7 @@ class CompetitiveIntelligence:
                 "customer_retention_rate": 0.55,
                 "gross_margin": 0.60,
                 "inventory_turnover": 12.0
-            },invoice_service = InvoiceService()
+            },
             "services": {
                 "avg_order_value": 150.0,
                 "customer_retention_rate": 0.75,
@@ -36,13 +48,26 @@ class CompetitiveIntelligence:
                 "inventory_turnover": 8.0
             }
         }
+        
+        # Display names for metric keys, built once instead of per comparison
+        metric_keys = {"total_revenue", "revenue_per_customer"}
+        for benchmarks in self.industry_benchmarks.values():
+            metric_keys.update(benchmarks)
+        self._metric_display = {key: key.replace("_", " ").title() for key in metric_keys}
+    
+    def _get_analytics(self):
+        """Return the shared advanced analytics instance, creating it on first use"""
+        if self._analytics is None:
+            if create_advanced_analytics is None:
+                raise RuntimeError("Advanced analytics is not available")
+            self._analytics = create_advanced_analytics(self.db_manager)
+        return self._analytics
     
     def run_competitive_analysis(self, user_id: str, industry: str = "general") -> Dict:
         """Run comprehensive competitive analysis"""
         try:
             # Get user's business data
-            from .advanced_analytics import create_advanced_analytics
-            analytics = create_advanced_analytics(self.db_manager)
+            analytics = self._get_analytics()
             
             user_analysis = analytics.run_comprehensive_analysis(user_id, 90)
             
@@ -89,21 +114,18 @@ class CompetitiveIntelligence:
     def analyze_market_trends(self, user_id: str, days_back: int = 180) -> Dict:
         """Analyze market trends and business trajectory"""
         try:
-            from .sales_models import SalesDataManager
+            if SalesDataManager is None:
+                raise RuntimeError("Sales data manager is not available")
             sales_manager = SalesDataManager(self.db_manager)
             
             # Get extended historical data
             end_date = datetime.utcnow()
             start_date = end_date - timedelta(days=days_back)
-            sales_data = sales_manager.get_sales_data(user_id, start_date, end_date, limit=2000)
+            df = sales_manager.get_sales_frame(user_id, start_date, end_date, limit=2000)
             
-            if len(sales_data) < 20:
+            if len(df) < 20:
                 return {"status": "insufficient_data", "message": "Need more historical data"}
             
-            df = pd.DataFrame(sales_data)
-            df['date'] = pd.to_datetime(df['date'])
-            df['total_amount'] = pd.to_numeric(df['total_amount'], errors='coerce')
-            
             # Monthly trend analysis
             monthly_trends = self._analyze_monthly_trends(df)
             
@@ -136,8 +158,7 @@ class CompetitiveIntelligence:
                 metrics = ["avg_order_value", "customer_retention_rate", "gross_margin"]
             
             # Get user performance data
-            from .advanced_analytics import create_advanced_analytics
-            analytics = create_advanced_analytics(self.db_manager)
+            analytics = self._get_analytics()
             user_analysis = analytics.run_comprehensive_analysis(user_id, 90)
             
             if user_analysis.get("status") != "success":
@@ -243,7 +264,7 @@ class CompetitiveIntelligence:
                     ratio = user_metrics[metric] / benchmark_value
                     performance_scores.append(min(2.0, ratio))  # Cap at 2x benchmark
             
-            avg_performance = np.mean(performance_scores) if performance_scores else 1.0
+            avg_performance = fmean(performance_scores) if performance_scores else 1.0
             
             # Determine market position
             if avg_performance >= 1.3:
@@ -270,9 +291,9 @@ class CompetitiveIntelligence:
                 if metric in user_metrics and benchmark_value > 0:
                     ratio = user_metrics[metric] / benchmark_value
                     if ratio >= 1.2:
-                        strengths.append(metric.replace("_", " ").title())
+                        strengths.append(self._metric_display[metric])
                     elif ratio <= 0.8:
-                        weaknesses.append(metric.replace("_", " ").title())
+                        weaknesses.append(self._metric_display[metric])
             
             return {
                 "market_position": position,
@@ -402,7 +423,7 @@ class CompetitiveIntelligence:
                 score = min(100, ratio * 50)  # 2x benchmark = 100 points
                 scores.append(score)
             
-            overall_score = np.mean(scores) if scores else 50
+            overall_score = fmean(scores) if scores else 50
             
             # Determine grade
             if overall_score >= 80:
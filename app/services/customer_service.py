@@ -1,7 +1,30 @@
 import logging
-from typing import List, Optional, Dict, Any
+import re
+import uuid
+from typing import List, Optional, Dict, Any, Union, Iterable, Iterator, Tuple
 from datetime import datetime
-from ..models.invoice_models import Customer, Address
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import OperationFailure
+from ..models.database import CUSTOMER_NAME_INDEX
+from ..models.invoice_models import Customer, Address, overdue_expression
+from ..utils.cache import TTLCache
+
+# Only the fields Customer.from_dict reads are fetched from MongoDB
+CUSTOMER_PROJECTION = {'_id': 0, **{name: 1 for name in Customer.__dataclass_fields__}}
+
+# Fields returned for search result listings
+SEARCH_PROJECTION = {'_id': 0, 'id': 1, 'name': 1, 'email': 1, 'company': 1, 'phone': 1}
+
+# Queries shorter than this use an anchored name prefix match instead of $text
+MIN_TEXT_SEARCH_LENGTH = 3
+
+ADDRESS_FIELDS = tuple(Address.__dataclass_fields__)
+
+
+def _address_doc(data: Dict) -> Dict:
+    """Normalize raw address input to the stored address shape"""
+    return {name: data.get(name, "") for name in ADDRESS_FIELDS}
+
 
 class CustomerService:
     """Service for managing customers"""
@@ -9,57 +32,105 @@ class CustomerService:
     def __init__(self, db_manager=None):
         self.db_manager = db_manager
         self.logger = logging.getLogger(__name__)
+        
+        # Recently fetched customers keyed by (user_id, customer_id)
+        self._cache = TTLCache(maxsize=4096, ttl=60)
     
-    def create_customer(self, user_id: str, customer_data: Dict) -> Optional[Customer]:
-        """Create a new customer"""
+    def _collection(self, name: str):
+        """Return a MongoDB collection, or None when the database is not connected"""
         try:
-            customer = Customer(
-                name=customer_data.get('name', ''),
-                email=customer_data.get('email', ''),
-                phone=customer_data.get('phone', ''),
-                company=customer_data.get('company', ''),
-                tax_id=customer_data.get('tax_id', ''),
-                payment_terms=customer_data.get('payment_terms', 30),
-                notes=customer_data.get('notes', '')
-            )
-            
-            # Set billing address
-            if customer_data.get('billing_address'):
-                customer.billing_address = Address.from_dict(customer_data['billing_address'])
-            
-            # Set shipping address if different
-            if customer_data.get('shipping_address'):
-                customer.shipping_address = Address.from_dict(customer_data['shipping_address'])
+            return self.db_manager.collections.get(name)
+        except AttributeError:
+            return None
+    
+    def _make_customer_doc(self, user_id: str, customer_data: Dict) -> Dict:
+        """Build the stored customer document directly from raw input data"""
+        now = datetime.utcnow()
+        billing_address = customer_data.get('billing_address')
+        shipping_address = customer_data.get('shipping_address')
+        
+        return {
+            'id': str(uuid.uuid4()),
+            'name': customer_data.get('name', ''),
+            'email': customer_data.get('email', ''),
+            'phone': customer_data.get('phone', ''),
+            'company': customer_data.get('company', ''),
+            'billing_address': _address_doc(billing_address or {}),
+            'shipping_address': _address_doc(shipping_address) if shipping_address else None,
+            'tax_id': customer_data.get('tax_id', ''),
+            'payment_terms': customer_data.get('payment_terms', 30),
+            'notes': customer_data.get('notes', ''),
+            'created_at': now,
+            'updated_at': now,
+            'user_id': user_id
+        }
+    
+    def create_customer(self, user_id: str, customer_data: Dict, return_object: bool = True) -> Union[Customer, str, None]:
+        """Create a new customer
+        
+        Returns the Customer, or only its id when return_object is False.
+        """
+        try:
+            customer_doc = self._make_customer_doc(user_id, customer_data)
             
             # Save to database
-            if self.db_manager and hasattr(self.db_manager, 'collections'):
-                customer_doc = customer.to_dict()
-                customer_doc['user_id'] = user_id
-                
-                result = self.db_manager.collections['customers'].insert_one(customer_doc)
+            customers = self._collection('customers')
+            if customers is not None:
+                result = customers.insert_one(customer_doc)
                 if result.inserted_id:
-                    self.logger.info(f"Customer created: {customer.id}")
-                    return customer
+                    self.logger.info(f"Customer created: {customer_doc['id']}")
             
-            return customer
+            if not return_object:
+                return customer_doc['id']
+            return Customer.from_dict(customer_doc)
             
         except Exception as e:
             self.logger.error(f"Error creating customer: {e}")
             return None
     
+    def create_customers_bulk(self, user_id: str, customers_data: List[Dict], return_objects: bool = True) -> List[Union[Customer, str]]:
+        """Create several customers in a single unordered bulk write
+        
+        Returns the Customers, or only their ids when return_objects is False.
+        """
+        try:
+            customer_docs = [self._make_customer_doc(user_id, customer_data) for customer_data in customers_data]
+            
+            customers = self._collection('customers')
+            if customer_docs and customers is not None:
+                operations = [InsertOne(customer_doc) for customer_doc in customer_docs]
+                result = customers.bulk_write(operations, ordered=False)
+                self.logger.info(f"Customers created in bulk: {result.inserted_count}")
+            
+            if not return_objects:
+                return [customer_doc['id'] for customer_doc in customer_docs]
+            return [Customer.from_dict(customer_doc) for customer_doc in customer_docs]
+            
+        except Exception as e:
+            self.logger.error(f"Error creating customers in bulk: {e}")
+            return []
+    
     def get_customer(self, user_id: str, customer_id: str) -> Optional[Customer]:
         """Get customer by ID"""
         try:
-            if not self.db_manager or not hasattr(self.db_manager, 'collections'):
+            customers = self._collection('customers')
+            if customers is None:
                 return None
             
-            customer_doc = self.db_manager.collections['customers'].find_one({
-                'user_id': user_id,
-                'id': customer_id
-            })
+            cache_key = (user_id, customer_id)
+            customer = self._cache.get(cache_key)
+            if customer is not None:
+                return customer
+            
+            customer_doc = customers.find_one(
+                {'user_id': user_id, 'id': customer_id},
+                CUSTOMER_PROJECTION
+            )
             
             if customer_doc:
-                return Customer.from_dict(customer_doc)
+                customer = Customer.from_dict(customer_doc)
+                self._cache.set(cache_key, customer)
+                return customer
             
             return None
             
@@ -67,18 +138,52 @@ class CustomerService:
             self.logger.error(f"Error getting customer: {e}")
             return None
     
+    def get_customers_by_ids(self, user_id: str, customer_ids: Iterable[str]) -> Dict[str, Customer]:
+        """Get several customers keyed by ID, fetching cache misses in one query"""
+        try:
+            customers = self._collection('customers')
+            if customers is None:
+                return {}
+            
+            found = {}
+            missing = []
+            for customer_id in set(customer_ids):
+                customer = self._cache.get((user_id, customer_id))
+                if customer is not None:
+                    found[customer_id] = customer
+                else:
+                    missing.append(customer_id)
+            
+            if missing:
+                cursor = customers.find(
+                    {'user_id': user_id, 'id': {'$in': missing}},
+                    CUSTOMER_PROJECTION
+                )
+                for customer_doc in cursor:
+                    customer = Customer.from_dict(customer_doc)
+                    self._cache.set((user_id, customer.id), customer)
+                    found[customer.id] = customer
+            
+            return found
+            
+        except Exception as e:
+            self.logger.error(f"Error getting customers: {e}")
+            return {}
+    
     def update_customer(self, user_id: str, customer_id: str, updates: Dict) -> bool:
         """Update customer information"""
         try:
-            if not self.db_manager or not hasattr(self.db_manager, 'collections'):
+            customers = self._collection('customers')
+            if customers is None:
                 return False
             
             updates['updated_at'] = datetime.utcnow()
             
-            result = self.db_manager.collections['customers'].update_one(
+            result = customers.update_one(
                 {'user_id': user_id, 'id': customer_id},
                 {'$set': updates}
             )
+            self._cache.pop((user_id, customer_id))
             
             return result.modified_count > 0
             
@@ -86,26 +191,62 @@ class CustomerService:
             self.logger.error(f"Error updating customer: {e}")
             return False
     
+    def update_customers_bulk(self, user_id: str, updates_by_id: Dict[str, Dict]) -> int:
+        """Apply updates to several customers in a single unordered bulk write
+        
+        Returns the number of customers modified.
+        """
+        try:
+            customers = self._collection('customers')
+            if customers is None:
+                return 0
+            
+            if not updates_by_id:
+                return 0
+            
+            now = datetime.utcnow()
+            operations = [
+                UpdateOne(
+                    {'user_id': user_id, 'id': customer_id},
+                    {'$set': {**updates, 'updated_at': now}}
+                )
+                for customer_id, updates in updates_by_id.items()
+            ]
+            
+            result = customers.bulk_write(operations, ordered=False)
+            
+            for customer_id in updates_by_id:
+                self._cache.pop((user_id, customer_id))
+            
+            return result.modified_count
+            
+        except Exception as e:
+            self.logger.error(f"Error updating customers in bulk: {e}")
+            return 0
+    
     def delete_customer(self, user_id: str, customer_id: str) -> bool:
         """Delete a customer"""
         try:
-            if not self.db_manager or not hasattr(self.db_manager, 'collections'):
+            customers = self._collection('customers')
+            invoices = self._collection('invoices')
+            if customers is None or invoices is None:
                 return False
             
-            # Check if customer has any invoices
-            invoice_count = self.db_manager.collections['invoices'].count_documents({
-                'user_id': user_id,
-                'customer_id': customer_id
-            })
+            # Check if customer has any invoices; the first match is enough
+            has_invoice = invoices.find_one(
+                {'user_id': user_id, 'customer_id': customer_id},
+                {'_id': 1}
+            )
             
-            if invoice_count > 0:
-                self.logger.warning(f"Cannot delete customer {customer_id}: has {invoice_count} invoices")
+            if has_invoice:
+                self.logger.warning(f"Cannot delete customer {customer_id}: has invoices")
                 return False
             
-            result = self.db_manager.collections['customers'].delete_one({
+            result = customers.delete_one({
                 'user_id': user_id,
                 'id': customer_id
             })
+            self._cache.pop((user_id, customer_id))
             
             return result.deleted_count > 0
             
@@ -113,52 +254,106 @@ class CustomerService:
             self.logger.error(f"Error deleting customer: {e}")
             return False
     
-    def list_customers(self, user_id: str, limit: int = 50, skip: int = 0) -> List[Customer]:
-        """List all customers for a user"""
+    def iter_customers(self, user_id: str, limit: int = 50, skip: int = 0) -> Iterator[Customer]:
+        """Yield a user's customers one at a time, ordered by name"""
+        customers = self._collection('customers')
+        if customers is None:
+            return
+        
+        cursor = customers.find(
+            {'user_id': user_id}, CUSTOMER_PROJECTION
+        ).sort([('name', 1), ('id', 1)]).skip(skip).limit(limit).batch_size(min(limit, 200))
+        
+        for customer_doc in cursor:
+            yield Customer.from_dict(customer_doc)
+    
+    def list_customers_after(
+        self, 
+        user_id: str, 
+        limit: int = 50, 
+        after: Optional[Tuple[str, str]] = None
+    ) -> Tuple[List[Customer], Optional[Tuple[str, str]]]:
+        """List customers by name using keyset pagination
+        
+        Args:
+            user_id: User ID
+            limit: Page size
+            after: (name, id) of the last customer on the previous page
+            
+        Returns:
+            Tuple of (customers, cursor for the next page or None)
+        """
         try:
-            if not self.db_manager or not hasattr(self.db_manager, 'collections'):
-                return []
+            customers = self._collection('customers')
+            if customers is None:
+                return [], None
+            
+            query = {'user_id': user_id}
+            if after:
+                after_name, after_id = after
+                # Seek past the previous page on the (user_id, name, id) index
+                query['$or'] = [
+                    {'name': {'$gt': after_name}},
+                    {'name': after_name, 'id': {'$gt': after_id}}
+                ]
             
-            customers = []
-            cursor = self.db_manager.collections['customers'].find({
-                'user_id': user_id
-            }).sort('name', 1).skip(skip).limit(limit)
+            cursor = customers.find(query, CUSTOMER_PROJECTION).sort(
+                [('name', 1), ('id', 1)]
+            ).limit(limit).batch_size(min(limit, 200))
             
-            for customer_doc in cursor:
-                customer = Customer.from_dict(customer_doc)
-                customers.append(customer)
+            page = [Customer.from_dict(customer_doc) for customer_doc in cursor]
+            next_cursor = (page[-1].name, page[-1].id) if len(page) == limit else None
             
-            return customers
+            return page, next_cursor
+            
+        except Exception as e:
+            self.logger.error(f"Error listing customers: {e}")
+            return [], None
+    
+    def list_customers(self, user_id: str, limit: int = 50, skip: int = 0) -> List[Customer]:
+        """List all customers for a user"""
+        try:
+            return list(self.iter_customers(user_id, limit, skip))
             
         except Exception as e:
             self.logger.error(f"Error listing customers: {e}")
             return []
     
     def search_customers(self, user_id: str, query: str, limit: int = 20) -> List[Customer]:
-        """Search customers by name, email, or company"""
+        """Search customers by name, email, or company
+        
+        Results carry only id, name, email, phone and company; use
+        get_customer for the full record.
+        """
         try:
-            if not self.db_manager or not hasattr(self.db_manager, 'collections'):
+            collection = self._collection('customers')
+            if collection is None:
                 return []
             
-            # Create text search filter
-            search_filter = {
-                'user_id': user_id,
-                '$or': [
-                    {'name': {'$regex': query, '$options': 'i'}},
-                    {'email': {'$regex': query, '$options': 'i'}},
-                    {'company': {'$regex': query, '$options': 'i'}},
-                    {'phone': {'$regex': query, '$options': 'i'}}
-                ]
-            }
-            
-            customers = []
-            cursor = self.db_manager.collections['customers'].find(search_filter).limit(limit)
-            
-            for customer_doc in cursor:
-                customer = Customer.from_dict(customer_doc)
-                customers.append(customer)
-            
-            return customers
+            if len(query) < MIN_TEXT_SEARCH_LENGTH:
+                # Short queries are treated as name prefixes (autocomplete)
+                search_filter = {
+                    'user_id': user_id,
+                    'name': re.compile(f'^{re.escape(query)}', re.IGNORECASE)
+                }
+                # Pin the (user_id, name) index so a collation index is never picked
+                try:
+                    cursor = collection.find(search_filter, SEARCH_PROJECTION).hint(CUSTOMER_NAME_INDEX).limit(limit)
+                    return [Customer.from_search_dict(customer_doc) for customer_doc in cursor]
+                except OperationFailure as e:
+                    self.logger.warning(f"Customer name index unavailable, searching without hint: {e}")
+                    cursor = collection.find(search_filter, SEARCH_PROJECTION).limit(limit)
+            else:
+                # Full-text search served by the customer_text index ($text takes no hint())
+                search_filter = {
+                    'user_id': user_id,
+                    '$text': {'$search': query}
+                }
+                cursor = collection.find(
+                    search_filter, {**SEARCH_PROJECTION, 'score': {'$meta': 'textScore'}}
+                ).sort([('score', {'$meta': 'textScore'})]).limit(limit)
+            
+            return [Customer.from_search_dict(customer_doc) for customer_doc in cursor]
             
         except Exception as e:
             self.logger.error(f"Error searching customers: {e}")
@@ -167,10 +362,14 @@ class CustomerService:
     def get_customer_stats(self, user_id: str, customer_id: str) -> Dict:
         """Get customer statistics"""
         try:
-            if not self.db_manager or not hasattr(self.db_manager, 'collections'):
+            invoices = self._collection('invoices')
+            if invoices is None:
                 return {}
             
-            # Aggregate invoice statistics
+            now = datetime.utcnow()
+            
+            # Totals and overdue count in one round-trip; only the leading $match
+            # uses an index, the overdue count is computed while grouping
             pipeline = [
                 {'$match': {'user_id': user_id, 'customer_id': customer_id}},
                 {'$group': {
@@ -180,25 +379,11 @@ class CustomerService:
                     'paid_amount': {'$sum': '$paid_amount'},
                     'outstanding_amount': {'$sum': {'$subtract': ['$total_amount', '$paid_amount']}},
                     'avg_invoice_amount': {'$avg': '$total_amount'},
-                    'overdue_count': {
-                        '$sum': {
-                            '$cond': [
-                                {
-                                    '$and': [
-                                        {'$lt': ['$due_date', datetime.utcnow()]},
-                                        {'$ne': ['$payment_status', 'paid']},
-                                        {'$ne': ['$status', 'cancelled']}
-                                    ]
-                                },
-                                1,
-                                0
-                            ]
-                        }
-                    }
+                    'overdue_count': {'$sum': {'$cond': [overdue_expression(now), 1, 0]}}
                 }}
             ]
             
-            result = list(self.db_manager.collections['invoices'].aggregate(pipeline))
+            result = list(invoices.aggregate(pipeline))
             
             if result:
                 stats = result[0]
@@ -217,6 +402,40 @@ class CustomerService:
         except Exception as e:
             self.logger.error(f"Error getting customer stats: {e}")
             return {}
+    
+    def get_all_customer_stats(self, user_id: str) -> Dict[str, Dict]:
+        """Get invoice statistics for every customer of a user in one aggregation"""
+        try:
+            invoices = self._collection('invoices')
+            if invoices is None:
+                return {}
+            
+            now = datetime.utcnow()
+            
+            # One result document per customer, streamed from a cursor so large
+            # tenants never hit the 16 MB limit of a single document
+            pipeline = [
+                {'$match': {'user_id': user_id}},
+                {'$group': {
+                    '_id': '$customer_id',
+                    'total_invoices': {'$sum': 1},
+                    'total_amount': {'$sum': '$total_amount'},
+                    'paid_amount': {'$sum': '$paid_amount'},
+                    'outstanding_amount': {'$sum': {'$subtract': ['$total_amount', '$paid_amount']}},
+                    'avg_invoice_amount': {'$avg': '$total_amount'},
+                    'overdue_count': {'$sum': {'$cond': [overdue_expression(now), 1, 0]}}
+                }}
+            ]
+            
+            stats_by_customer = {}
+            for stats in invoices.aggregate(pipeline):
+                stats_by_customer[stats.pop('_id')] = stats
+            
+            return stats_by_customer
+            
+        except Exception as e:
+            self.logger.error(f"Error getting stats for all customers: {e}")
+            return {}
 
 # Initialize service instance
 customer_service = CustomerService()
\ No newline at end of file
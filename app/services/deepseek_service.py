@@ -1,8 +1,56 @@
+import asyncio
+import contextlib
 import requests
 import logging
+from types import MappingProxyType
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import current_app
 from typing import Dict, List, Optional
-import json
+from ..utils.json_utils import dumps_context, dumps_bytes, loads
+from ..utils.circuit_breaker import CircuitBreaker
+
+try:
+    import aiohttp
+except ImportError:  # async variant unavailable, sync calls still work
+    aiohttp = None
+
+# Custom system prompts based on intent
+SYSTEM_PROMPTS = MappingProxyType({
+    "sales_forecast": """You are Korra, an AI sales forecasting expert. Help users understand sales trends and make predictions. 
+    Be specific about data requirements and forecasting methods. Keep responses under 150 words and use emojis.""",
+    
+    "anomaly_detection": """You are Korra, an AI anomaly detection specialist. Help users identify unusual business patterns. 
+    Explain what anomalies mean and suggest investigative steps. Keep responses under 150 words and use emojis.""",
+    
+    "invoice_generation": """You are Korra, an AI invoice and billing assistant. Help users create professional invoices. 
+    Guide them through required information and formatting. Keep responses under 150 words and use emojis.""",
+    
+    "business_insights": """You are Korra, an AI business intelligence analyst. Help users understand their business metrics. 
+    Provide actionable insights and recommendations. Keep responses under 150 words and use emojis.""",
+    
+    "operational_support": """You are Korra, an AI business operations consultant. Help users with growth strategies and operations. 
+    Give practical, actionable advice for small businesses. Keep responses under 150 words and use emojis.""",
+    
+    "general": """You are Korra, an AI business assistant. You help with sales forecasting, anomaly detection, invoices, 
+    business insights, and operational guidance. Be friendly, helpful, and concise. Keep responses under 150 words and use emojis."""
+})
+
+# Canned replies used when the API is unavailable
+FALLBACK_RESPONSES = MappingProxyType({
+    "sales_forecast": "📊 *Sales Forecasting*\n\nI'd love to help with sales forecasting! While my AI is temporarily offline, I can guide you through the process:\n\n• Collect your past sales data (3-6 months)\n• Identify seasonal patterns\n• Consider external factors\n\nWhat time period would you like to forecast?",
+    
+    "anomaly_detection": "🔍 *Anomaly Detection*\n\nI'm here to help spot unusual patterns! While my AI is temporarily offline, I can help you manually check:\n\n• Sudden sales drops/spikes\n• Unusual customer behavior\n• Inventory discrepancies\n\nWhat specific area concerns you?",
+    
+    "invoice_generation": "📄 *Invoice Generation*\n\nI can help create professional invoices! While my AI is temporarily offline, let's gather the basics:\n\n• Customer information\n• Items/services provided\n• Pricing and quantities\n\nWho is this invoice for?",
+    
+    "business_insights": "📈 *Business Insights*\n\nI'm ready to analyze your business! While my AI is temporarily offline, I can help you focus on:\n\n• Top-selling products\n• Revenue trends\n• Customer patterns\n\nWhat specific insights do you need?",
+    
+    "operational_support": "💡 *Business Guidance*\n\nI'm here to help grow your business! While my AI is temporarily offline, here are proven strategies:\n\n• Customer retention programs\n• Marketing automation\n• Operational efficiency\n\nWhat area would you like to improve?",
+    
+    "general": "🤖 *Korra Assistant*\n\nI'm experiencing some technical difficulties, but I'm still here to help!\n\nI can assist with:\n📊 Sales Forecasting\n📄 Invoice Creation\n📈 Business Insights\n🔍 Anomaly Detection\n💡 Business Strategy\n\nWhat would you like to work on?"
+})
+
 
 class DeepSeekService:
     """DeepSeek AI service for business intelligence responses"""
@@ -10,71 +58,85 @@ class DeepSeekService:
     def __init__(self):
         self.base_url = "https://api.deepseek.com/v1/chat/completions"
         self.model = "deepseek-chat"
-    
-    def generate_business_response(self, user_message: str, intent: str = "general", context: Dict = None) -> str:
-        """Generate contextual business responses using DeepSeek"""
         
-        # Custom system prompts based on intent
-        system_prompts = {
-            "sales_forecast": """You are Korra, an AI sales forecasting expert. Help users understand sales trends and make predictions. 
-            Be specific about data requirements and forecasting methods. Keep responses under 150 words and use emojis.""",
-            
-            "anomaly_detection": """You are Korra, an AI anomaly detection specialist. Help users identify unusual business patterns. 
-            Explain what anomalies mean and suggest investigative steps. Keep responses under 150 words and use emojis.""",
-            
-            "invoice_generation": """You are Korra, an AI invoice and billing assistant. Help users create professional invoices. 
-            Guide them through required information and formatting. Keep responses under 150 words and use emojis.""",
-            
-            "business_insights": """You are Korra, an AI business intelligence analyst. Help users understand their business metrics. 
-            Provide actionable insights and recommendations. Keep responses under 150 words and use emojis.""",
-            
-            "operational_support": """You are Korra, an AI business operations consultant. Help users with growth strategies and operations. 
-            Give practical, actionable advice for small businesses. Keep responses under 150 words and use emojis.""",
-            
-            "general": """You are Korra, an AI business assistant. You help with sales forecasting, anomaly detection, invoices, 
-            business insights, and operational guidance. Be friendly, helpful, and concise. Keep responses under 150 words and use emojis."""
-        }
+        # Keep-alive session so the TLS connection is reused across messages
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=16,
+            # Completions are billed and not idempotent: retry only failed connects and
+            # 429/503, which are refused before the model runs. read/other=False re-raise
+            # the original error so a ReadTimeout still reaches the Timeout handler
+            max_retries=Retry(
+                total=2,
+                connect=2,
+                read=False,
+                status=2,
+                other=False,
+                backoff_factor=0.3,
+                status_forcelist=[429, 503],
+                allowed_methods=frozenset(["POST"]),
+                respect_retry_after_header=False
+            )
+        )
+        self.session.mount("https://", adapter)
         
-        system_prompt = system_prompts.get(intent, system_prompts["general"])
+        # Request headers, built once the API key has been resolved
+        self._headers = None
         
-        try:
+        # Stop calling the API for a minute after 5 consecutive failures
+        self.breaker = CircuitBreaker("deepseek", fail_max=5, reset_timeout=60)
+        
+        # Long-lived aiohttp session opened by open_async_session, bound to its loop
+        self._async_session = None
+        self._async_loop = None
+    
+    def _get_headers(self) -> Optional[Dict]:
+        """Return cached request headers, or None if the API key is not configured"""
+        if self._headers is None:
             api_key = current_app.config.get('DEEPSEEK_API_KEY')
             if not api_key or api_key == "your_deepseek_api_key_here":
-                logging.warning("DeepSeek API key not configured")
-                return self._get_fallback_response(user_message, intent)
+                return None
             
-            headers = {
+            self._headers = {
                 "Content-Type": "application/json",
                 "Authorization": f"Bearer {api_key}"
             }
+        
+        return self._headers
+    
+    def generate_business_response(self, user_message: str, intent: str = "general", context: Dict = None) -> str:
+        """Generate contextual business responses using DeepSeek"""
+        
+        try:
+            headers = self._get_headers()
+            if headers is None:
+                logging.warning("DeepSeek API key not configured")
+                return self._get_fallback_response(user_message, intent)
             
-            # Prepare context information
-            context_info = ""
-            if context:
-                context_info = f"\nUser Context: {json.dumps(context, default=str)}"
+            # Built before the breaker admits the call, so a bad payload cannot strand a trial
+            body = dumps_bytes(self._build_payload(user_message, intent, context))
             
-            payload = {
-                "model": self.model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"{user_message}{context_info}"}
-                ],
-                "max_tokens": 300,
-                "temperature": 0.7,
-                "stream": False
-            }
+            if not self.breaker.allow_request():
+                logging.warning("DeepSeek circuit open, using fallback response")
+                return self._get_fallback_response(user_message, intent)
             
             logging.info(f"Sending request to DeepSeek API for intent: {intent}")
             
-            response = requests.post(
-                self.base_url, 
-                headers=headers, 
-                json=payload,
-                timeout=30
-            )
+            status_code = None
+            try:
+                response = self.session.post(
+                    self.base_url, 
+                    headers=headers, 
+                    data=body,
+                    timeout=30
+                )
+                status_code = response.status_code
+            finally:
+                self._record_status(status_code)
             
             if response.status_code == 200:
-                result = response.json()
+                result = loads(response.content)
                 ai_response = result['choices'][0]['message']['content'].strip()
                 logging.info("DeepSeek API response received successfully")
                 return ai_response
@@ -94,24 +156,124 @@ class DeepSeekService:
             logging.error(f"DeepSeek API unexpected error: {e}")
             return self._get_fallback_response(user_message, intent)
     
-    def _get_fallback_response(self, user_message: str, intent: str) -> str:
-        """Provide fallback responses when API is unavailable"""
+    async def generate_business_response_async(self, user_message: str, intent: str = "general", context: Dict = None) -> str:
+        """Async variant of generate_business_response for ASGI callers"""
+        
+        if aiohttp is None:
+            logging.error("aiohttp is not installed, async DeepSeek calls unavailable")
+            return self._get_fallback_response(user_message, intent)
         
-        fallback_responses = {
-            "sales_forecast": "📊 *Sales Forecasting*\n\nI'd love to help with sales forecasting! While my AI is temporarily offline, I can guide you through the process:\n\n• Collect your past sales data (3-6 months)\n• Identify seasonal patterns\n• Consider external factors\n\nWhat time period would you like to forecast?",
+        try:
+            headers = self._get_headers()
+            if headers is None:
+                logging.warning("DeepSeek API key not configured")
+                return self._get_fallback_response(user_message, intent)
             
-            "anomaly_detection": "🔍 *Anomaly Detection*\n\nI'm here to help spot unusual patterns! While my AI is temporarily offline, I can help you manually check:\n\n• Sudden sales drops/spikes\n• Unusual customer behavior\n• Inventory discrepancies\n\nWhat specific area concerns you?",
+            # Built before the breaker admits the call, so a bad payload cannot strand a trial
+            request_body = dumps_bytes(self._build_payload(user_message, intent, context))
             
-            "invoice_generation": "📄 *Invoice Generation*\n\nI can help create professional invoices! While my AI is temporarily offline, let's gather the basics:\n\n• Customer information\n• Items/services provided\n• Pricing and quantities\n\nWho is this invoice for?",
+            if not self.breaker.allow_request():
+                logging.warning("DeepSeek circuit open, using fallback response")
+                return self._get_fallback_response(user_message, intent)
             
-            "business_insights": "📈 *Business Insights*\n\nI'm ready to analyze your business! While my AI is temporarily offline, I can help you focus on:\n\n• Top-selling products\n• Revenue trends\n• Customer patterns\n\nWhat specific insights do you need?",
+            logging.info(f"Sending async request to DeepSeek API for intent: {intent}")
             
-            "operational_support": "💡 *Business Guidance*\n\nI'm here to help grow your business! While my AI is temporarily offline, here are proven strategies:\n\n• Customer retention programs\n• Marketing automation\n• Operational efficiency\n\nWhat area would you like to improve?",
+            # Recorded on every exit, including cancellation of this task
+            status_code = None
+            try:
+                async with self._async_session_scope() as session:
+                    async with session.post(self.base_url, headers=headers, data=request_body) as response:
+                        body = await response.read()
+                status_code = response.status
+            finally:
+                self._record_status(status_code)
             
-            "general": "🤖 *Korra Assistant*\n\nI'm experiencing some technical difficulties, but I'm still here to help!\n\nI can assist with:\n📊 Sales Forecasting\n📄 Invoice Creation\n📈 Business Insights\n🔍 Anomaly Detection\n💡 Business Strategy\n\nWhat would you like to work on?"
-        }
+            if response.status == 200:
+                result = loads(body)
+                ai_response = result['choices'][0]['message']['content'].strip()
+                logging.info("DeepSeek API response received successfully")
+                return ai_response
+            else:
+                logging.error(f"DeepSeek API error: {response.status} - {body[:500]!r}")
+                return self._get_fallback_response(user_message, intent)
+                
+        except asyncio.TimeoutError:
+            logging.error("DeepSeek API timeout")
+            return "⏱️ I'm taking a moment to think. Please try again in a few seconds."
+            
+        except aiohttp.ClientError as e:
+            logging.error(f"DeepSeek API request error: {e}")
+            return self._get_fallback_response(user_message, intent)
+            
+        except Exception as e:
+            logging.error(f"DeepSeek API unexpected error: {e}")
+            return self._get_fallback_response(user_message, intent)
+    
+    def _record_status(self, status_code: Optional[int]):
+        """Count failed requests, throttling and server errors against the circuit breaker"""
+        if status_code is None or status_code == 429 or status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+    
+    def _new_async_session(self):
+        """Create an aiohttp session with the API timeout and a bounded pool"""
+        return aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=30),
+            connector=aiohttp.TCPConnector(limit=32)
+        )
+    
+    @contextlib.asynccontextmanager
+    async def _async_session_scope(self):
+        """Yield the long-lived session of the running loop, or a session closed on exit
         
-        return fallback_responses.get(intent, fallback_responses["general"])
+        Callers that run each call in a fresh loop (asyncio.run) get a scoped
+        session, so no session outlives the loop it was created on.
+        """
+        session = self._async_session
+        if session is not None and not session.closed and self._async_loop is asyncio.get_running_loop():
+            yield session
+        else:
+            async with self._new_async_session() as session:
+                yield session
+    
+    async def open_async_session(self):
+        """Open a session reused by async calls on this loop, e.g. on ASGI app startup"""
+        await self.close_async_session()
+        self._async_session = self._new_async_session()
+        self._async_loop = asyncio.get_running_loop()
+    
+    async def close_async_session(self):
+        """Close the long-lived session, e.g. on ASGI app shutdown"""
+        session = self._async_session
+        self._async_session = None
+        self._async_loop = None
+        if session is not None and not session.closed:
+            await session.close()
+    
+    def _build_payload(self, user_message: str, intent: str, context: Optional[Dict]) -> Dict:
+        """Build the chat completion request body"""
+        system_prompt = SYSTEM_PROMPTS.get(intent, SYSTEM_PROMPTS["general"])
+        
+        # Prepare context information
+        context_info = ""
+        if context:
+            context_info = f"\nUser Context: {dumps_context(context)}"
+        
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"{user_message}{context_info}"}
+            ],
+            "max_tokens": 300,
+            "temperature": 0.7,
+            "stream": False
+        }
+    
+    def _get_fallback_response(self, user_message: str, intent: str) -> str:
+        """Provide fallback responses when API is unavailable"""
+        return FALLBACK_RESPONSES.get(intent, FALLBACK_RESPONSES["general"])
 
 # Initialize the service
 deepseek_service = DeepSeekService()
\ No newline at end of file
@@ -1,32 +1,300 @@
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
 from flask import current_app
-from typing import Dict, List, Any, Optional, Tuple
-import io
+from typing import BinaryIO, Dict, List, Any, Optional, Tuple
+import functools
 import json
+import multiprocessing
+import os
 import re
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from itertools import repeat
+from ..utils.cache import TTLCache
 
 # PDF processing
 import PyPDF2
 import pdfplumber
 
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # text extraction falls back to pdfplumber
+    pdfium = None
+
 # DOCX processing
 from docx import Document
 
 # Advanced CSV processing
 import csv
 
+try:
+    import charset_normalizer
+except ImportError:  # CSV uploads are read as UTF-8, then latin-1
+    charset_normalizer = None
+
+try:
+    import pyarrow
+except ImportError:  # CSV uploads use the pandas C parser
+    pyarrow = None
+
+try:
+    import python_calamine
+except ImportError:  # Excel uploads use the pandas default engines
+    python_calamine = None
+
+# Rust-based reader for xlsx/xls when installed; None lets pandas pick openpyxl/xlrd
+EXCEL_ENGINE = 'calamine' if python_calamine is not None else None
+
+# Patterns to match sales data in free text. Whitespace and product names
+# never cross a line break, so a match always comes from a single line.
+_PAT_FULL = (  # Date Product Quantity Price Total
+    r'(?P<full_date>\d{1,2}[/-]\d{1,2}[/-]\d{2,4})[^\S\n]+(?P<full_product>[^$\d\n]+?)[^\S\n]+'
+    r'(?P<full_qty>\d+(?:\.\d+)?)[^\S\n]+\$?(?P<full_price>\d+(?:\.\d+)?)[^\S\n]+\$?(?P<full_total>\d+(?:\.\d+)?)'
+)
+_PAT_DATED = (  # Product: $Amount on Date
+    r'(?P<dated_product>[^:$\d\n]+?):[^\S\n]*\$?(?P<dated_amount>\d+(?:\.\d+)?)[^\S\n]+'
+    r'(?:on|dated?)[^\S\n]+(?P<dated_date>\d{1,2}[/-]\d{1,2}[/-]\d{2,4})'
+)
+_PAT_SOLD = (  # Sold X Product for $Y
+    r'sold[^\S\n]+(?P<sold_qty>\d+(?:\.\d+)?)[^\S\n]+(?P<sold_product>[^$\d\n]+?)[^\S\n]+'
+    r'(?:for|@)[^\S\n]*\$?(?P<sold_amount>\d+(?:\.\d+)?)'
+)
+_SALES_TEXT_PATTERN = re.compile(
+    f"(?P<full>{_PAT_FULL})|(?P<dated>{_PAT_DATED})|(?P<sold>{_PAT_SOLD})",
+    re.IGNORECASE
+)
+
+# Bytes of a CSV upload inspected to detect its encoding
+CSV_ENCODING_SAMPLE_SIZE = 64 * 1024
+
+# Words in column headers that suggest a table or sheet holds sales data
+_SALES_KEYWORDS = frozenset(['date', 'product', 'quantity', 'price', 'amount', 'total', 'sale', 'revenue'])
+_SALES_KEYWORD_PATTERN = re.compile('|'.join(sorted(_SALES_KEYWORDS)))
+
+# Words in column names that identify sales and product data
+_SALES_INDICATORS = re.compile('|'.join([
+    'date', 'product', 'quantity', 'price', 'amount', 'total',
+    'customer', 'sale', 'revenue', 'item'
+]))
+_PRODUCT_INDICATORS = re.compile('|'.join([
+    'product', 'name', 'price', 'cost', 'stock', 'inventory',
+    'category', 'sku', 'description'
+]))
+
+# Common column name variations for each sales record field, checked in order
+_SALES_COLUMN_PATTERNS = tuple(
+    (field, re.compile('|'.join(variations)))
+    for field, variations in [
+        ('date', ['date', 'sale_date', 'transaction_date', 'order_date']),
+        ('product_name', ['product', 'product_name', 'item', 'item_name', 'name']),
+        ('quantity', ['quantity', 'qty', 'amount', 'units']),
+        ('unit_price', ['price', 'unit_price', 'cost', 'rate']),
+        ('total_amount', ['total', 'total_amount', 'revenue', 'sales', 'value']),
+        ('customer_name', ['customer', 'customer_name', 'client', 'buyer']),
+    ]
+)
+
+# Rows of each Excel sheet read to pick the sheet holding the sales data
+EXCEL_SCORE_ROWS = 50
+
+# Largest upload processed, and the read size used while downloading it
+MAX_FILE_SIZE = 10 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Keep-alive session shared by media lookups and downloads
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504])
+))
+
+# Processed upload results by (media_id, user_id), kept for webhook redeliveries
+_RESULT_CACHE = TTLCache(maxsize=128, ttl=300)
+
+# Rows of an uploaded sales sheet converted and saved per batch
+SALES_SAVE_CHUNK_SIZE = 10000
+
+# Leading values of each text column parsed to decide whether it holds dates
+DATE_SAMPLE_ROWS = 50
+DATE_MIN_PARSED_FRACTION = 0.7
+
+# PDFs with at least this many pages have their tables extracted in parallel
+PDF_PARALLEL_MIN_PAGES = 20
+PDF_MAX_WORKERS = min(os.cpu_count() or 1, 4)
+
+_pdf_executor = None
+_pdf_executor_lock = threading.Lock()
+
+
+def _get_pdf_executor() -> ProcessPoolExecutor:
+    """Return the process pool shared by all PDF uploads, created on first use"""
+    global _pdf_executor
+    if _pdf_executor is None:
+        with _pdf_executor_lock:
+            if _pdf_executor is None:
+                # spawn avoids forking a process that holds MongoDB and HTTP client threads
+                _pdf_executor = ProcessPoolExecutor(
+                    max_workers=PDF_MAX_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+    return _pdf_executor
+
+
+def _collect_page_tables(pages) -> List[Tuple[int, int, List]]:
+    """Return (page number, table number, rows) for each table with a header and data"""
+    raw_tables = []
+    for page in pages:
+        # Table detection works off ruling lines, pages without any have no tables
+        if page.edges:
+            for table_num, table in enumerate(page.extract_tables()):
+                if table and len(table) > 1:  # At least header + one row
+                    raw_tables.append((page.page_number, table_num + 1, table))
+        
+        # Drop the page's parsed chars and shapes before moving on
+        page.close()
+    return raw_tables
+
+
+def _extract_page_tables(file_path: str, page_numbers: List[int]) -> List[Tuple[int, int, List]]:
+    """Extract tables from the given 1-based pages; runs in a worker process"""
+    with pdfplumber.open(file_path, pages=page_numbers) as pdf:
+        return _collect_page_tables(pdf.pages)
+
+
+def _count_keywords(columns, pattern: re.Pattern) -> int:
+    """Number of distinct keywords of pattern appearing anywhere in the column names"""
+    column_str = ' '.join(map(str, columns)).lower()
+    return len(set(pattern.findall(column_str)))
+
+
+def _date_columns(df: pd.DataFrame, text_cols: List[str], limit: Optional[int] = None) -> List[str]:
+    """Text columns whose sampled values mostly parse as dates, stopping after limit of them"""
+    date_cols = []
+    for col, values in df[text_cols].head(DATE_SAMPLE_ROWS).items():
+        values = values.dropna()
+        if values.empty:
+            continue
+        
+        # Coercion turns unparseable values into NaT instead of raising per column
+        parsed = pd.to_datetime(values, errors='coerce', format='mixed')
+        if parsed.notna().mean() > DATE_MIN_PARSED_FRACTION:
+            date_cols.append(col)
+            if limit is not None and len(date_cols) >= limit:
+                break
+    return date_cols
+
+
+def _merge_save_result(result: Dict, chunk_result: Dict):
+    """Add one chunk's save counters to the running totals, keeping the first 5 errors"""
+    for key in ("total_processed", "success_count", "error_count"):
+        result[key] += chunk_result.get(key, 0)
+    if len(result["errors"]) < 5:
+        result["errors"].extend(chunk_result.get("errors", [])[:5 - len(result["errors"])])
+
+
+@functools.lru_cache(maxsize=256)
+def _sales_column_mapping(columns: Tuple[str, ...]) -> Tuple[Tuple[str, str], ...]:
+    """(field, column) pairs for a header; users re-upload the same export layout"""
+    mapping = {}
+    
+    # Column order matters, a later column matching the same field wins
+    for col in columns:
+        for field, pattern in _SALES_COLUMN_PATTERNS:
+            if pattern.search(col):
+                mapping[field] = col
+                break
+    
+    return tuple(mapping.items())
+
+
+def _text_column(raw: pd.Series) -> pd.Series:
+    """Convert a name column to str once per distinct value, with missing values as empty strings"""
+    codes, uniques = pd.factorize(raw)
+    
+    # Code -1 marks missing values and picks the trailing "" label
+    labels = np.array([str(value) for value in uniques] + [""], dtype=object)
+    return pd.Series(labels.take(codes), index=raw.index, dtype=object)
+
+
+def _detect_encoding(sample: bytes) -> str:
+    """Best guess at the text encoding of a byte sample, defaulting to UTF-8"""
+    if charset_normalizer is None:
+        return 'utf-8'
+    
+    match = charset_normalizer.from_bytes(sample).best()
+    if match is None or match.encoding == 'ascii':
+        # An ASCII sample says nothing about the rest of the file, UTF-8 is its superset
+        return 'utf-8'
+    return match.encoding
+
+
+def _read_csv(file_buffer: BinaryIO, encoding: str) -> pd.DataFrame:
+    """Read a CSV upload with the multithreaded pyarrow parser, or the C parser without it"""
+    if pyarrow is not None:
+        try:
+            file_buffer.seek(0)
+            return pd.read_csv(file_buffer, encoding=encoding, engine='pyarrow', on_bad_lines='skip')
+        except Exception as e:
+            # Quoting or decoding pyarrow rejects is retried with the more lenient C parser
+            logging.warning(f"pyarrow could not parse CSV, using the C parser: {e}")
+    
+    file_buffer.seek(0)
+    return pd.read_csv(file_buffer, encoding=encoding, engine='c', low_memory=False, on_bad_lines='skip')
+
+
 class EnhancedFileProcessor:
     """Enhanced file processor supporting CSV, PDF, DOCX with intelligent content extraction"""
     
+    # Processing method for each supported file extension
+    _HANDLERS = {
+        'csv': '_process_csv_enhanced',
+        'xlsx': '_process_excel_enhanced',
+        'xls': '_process_excel_enhanced',
+        'pdf': '_process_pdf_document',
+        'docx': '_process_docx_document',
+        'doc': '_process_docx_document'
+    }
+    
+    # MIME type fragments checked in order when the extension is not recognised
+    _MIME_HANDLERS = (
+        ('csv', '_process_csv_enhanced'),
+        ('excel', '_process_excel_enhanced'),
+        ('spreadsheet', '_process_excel_enhanced'),
+        ('pdf', '_process_pdf_document'),
+        ('word', '_process_docx_document'),
+        ('document', '_process_docx_document')
+    )
+    
     def __init__(self, db_manager):
         self.db_manager = db_manager
-        self.supported_formats = ['csv', 'xlsx', 'xls', 'pdf', 'docx', 'doc']
+        self.supported_formats = list(self._HANDLERS)
     
     def process_whatsapp_document(self, media_id: str, user_id: str) -> Dict:
         """Process document uploaded via WhatsApp with enhanced capabilities"""
+        # Webhook redeliveries of the same upload reuse the first result instead of importing twice
+        cache_key = (media_id, user_id)
+        result = _RESULT_CACHE.get(cache_key)
+        if result is not None:
+            logging.info(f"Reusing processed result for media {media_id}")
+            return result
+        
+        result = self._process_whatsapp_document(media_id, user_id)
+        
+        # Errors are not cached so a retry can still succeed
+        if result.get("status") != "error":
+            _RESULT_CACHE.set(cache_key, result)
+        
+        return result
+    
+    def _process_whatsapp_document(self, media_id: str, user_id: str) -> Dict:
+        """Download and route a WhatsApp document to its processor"""
         try:
             # Download file from WhatsApp
             file_data = self._download_whatsapp_media(media_id)
@@ -34,45 +302,44 @@ class EnhancedFileProcessor:
             if not file_data:
                 return {"status": "error", "message": "Could not download file"}
             
-            # Determine file type and process
-            filename = file_data.get('filename', '').lower()
-            mime_type = file_data.get('mime_type', '').lower()
-            file_size = file_data.get('size', 0)
-            
-            logging.info(f"Processing file: {filename} ({file_size} bytes, {mime_type})")
-            
-            # File size check (max 10MB)
-            if file_size > 10 * 1024 * 1024:
+            # File size check (max 10MB), enforced while downloading
+            if file_data.get('status') == 'too_large':
                 return {
                     "status": "error",
                     "message": "File too large (max 10MB). Please upload a smaller file."
                 }
             
-            # Route to appropriate processor
-            if filename.endswith('.csv') or 'csv' in mime_type:
-                return self._process_csv_enhanced(file_data['content'], user_id, filename)
-            
-            elif filename.endswith(('.xlsx', '.xls')) or 'excel' in mime_type or 'spreadsheet' in mime_type:
-                return self._process_excel_enhanced(file_data['content'], user_id, filename)
+            # Determine file type and process
+            filename = file_data.get('filename', '').lower()
+            mime_type = file_data.get('mime_type', '').lower()
+            file_size = file_data.get('size', 0)
             
-            elif filename.endswith('.pdf') or 'pdf' in mime_type:
-                return self._process_pdf_document(file_data['content'], user_id, filename)
+            logging.info(f"Processing file: {filename} ({file_size} bytes, {mime_type})")
             
-            elif filename.endswith(('.docx', '.doc')) or 'word' in mime_type or 'document' in mime_type:
-                return self._process_docx_document(file_data['content'], user_id, filename)
+            # Route to appropriate processor by extension, then by MIME type
+            handler_name = self._HANDLERS.get(filename.rpartition('.')[2]) if '.' in filename else None
+            if handler_name is None:
+                handler_name = next(
+                    (name for fragment, name in self._MIME_HANDLERS if fragment in mime_type), None
+                )
             
-            else:
+            if handler_name is None:
+                file_data['content'].close()
                 return {
                     "status": "error",
                     "message": f"Unsupported file type. Supported: CSV, Excel, PDF, Word documents."
                 }
+            
+            # Closing the temporary file also deletes it
+            with file_data['content'] as file_buffer:
+                return getattr(self, handler_name)(file_buffer, user_id, filename)
                 
         except Exception as e:
             logging.error(f"Enhanced file processing error: {e}")
             return {"status": "error", "message": f"Error processing file: {str(e)}"}
     
     def _download_whatsapp_media(self, media_id: str) -> Optional[Dict]:
-        """Download media file from WhatsApp"""
+        """Download media file from WhatsApp, or {'status': 'too_large'} past MAX_FILE_SIZE"""
         try:
             headers = {
                 "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}"
@@ -80,7 +347,7 @@ class EnhancedFileProcessor:
             
             # Get media URL
             url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{media_id}"
-            response = requests.get(url, headers=headers, timeout=30)
+            response = _SESSION.get(url, headers=headers, timeout=30)
             
             if response.status_code != 200:
                 logging.error(f"Failed to get media info: {response.status_code}")
@@ -93,71 +360,69 @@ class EnhancedFileProcessor:
                 logging.error("No media URL in response")
                 return None
             
-            # Download actual file
-            file_response = requests.get(media_url, headers=headers, timeout=60)
+            # Reject oversized files before transferring any of the body
+            if int(media_info.get('file_size') or 0) > MAX_FILE_SIZE:
+                logging.warning(f"Media {media_id} is {media_info['file_size']} bytes, not downloading")
+                return {'status': 'too_large'}
             
-            if file_response.status_code != 200:
-                logging.error(f"Failed to download file: {file_response.status_code}")
-                return None
+            # Stream the file into a single buffer handed to the parsers as-is
+            with _SESSION.get(media_url, headers=headers, stream=True, timeout=(5, 60)) as file_response:
+                if file_response.status_code != 200:
+                    logging.error(f"Failed to download file: {file_response.status_code}")
+                    return None
+                
+                if int(file_response.headers.get('Content-Length') or 0) > MAX_FILE_SIZE:
+                    logging.warning(f"Media {media_id} exceeds {MAX_FILE_SIZE} bytes, not downloading")
+                    return {'status': 'too_large'}
+                
+                # Spool to a temporary file so the upload lives in the page cache rather than
+                # the heap, and worker processes can open it by path.
+                # The declared length can be missing, so the limit is also checked per chunk
+                buffer = tempfile.NamedTemporaryFile(prefix="whatsapp-media-")
+                try:
+                    for chunk in file_response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        buffer.write(chunk)
+                        if buffer.tell() > MAX_FILE_SIZE:
+                            logging.warning(f"Media {media_id} exceeds {MAX_FILE_SIZE} bytes, download aborted")
+                            buffer.close()
+                            return {'status': 'too_large'}
+                except Exception:
+                    buffer.close()
+                    raise
+            
+            size = buffer.tell()
+            buffer.flush()
+            buffer.seek(0)
             
             return {
-                'content': file_response.content,
+                'content': buffer,
                 'mime_type': media_info.get('mime_type', ''),
                 'filename': media_info.get('filename', 'uploaded_file'),
-                'size': len(file_response.content)
+                'size': size
             }
             
         except Exception as e:
             logging.error(f"Error downloading WhatsApp media: {e}")
             return None
     
-    def _process_pdf_document(self, file_content: bytes, user_id: str, filename: str) -> Dict:
+    def _process_pdf_document(self, file_buffer: BinaryIO, user_id: str, filename: str) -> Dict:
         """Process PDF document and extract data"""
         try:
-            extracted_data = []
-            tables_found = []
-            text_content = ""
-            
-            # Method 1: Try pdfplumber for tables
-            try:
-                with pdfplumber.open(io.BytesIO(file_content)) as pdf:
-                    for page_num, page in enumerate(pdf.pages):
-                        # Extract text
-                        page_text = page.extract_text()
-                        if page_text:
-                            text_content += f"\n--- Page {page_num + 1} ---\n{page_text}"
-                        
-                        # Extract tables
-                        tables = page.extract_tables()
-                        for table_num, table in enumerate(tables):
-                            if table and len(table) > 1:  # At least header + one row
-                                df = pd.DataFrame(table[1:], columns=table[0])
-                                tables_found.append({
-                                    'page': page_num + 1,
-                                    'table': table_num + 1,
-                                    'dataframe': df
-                                })
-                
-                logging.info(f"Extracted {len(tables_found)} tables from PDF")
-                
-            except Exception as e:
-                logging.warning(f"pdfplumber extraction failed: {e}")
-            
-            # Method 2: Fallback to PyPDF2 for text
-            if not text_content:
-                try:
-                    pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-                    for page_num, page in enumerate(pdf_reader.pages):
-                        page_text = page.extract_text()
-                        text_content += f"\n--- Page {page_num + 1} ---\n{page_text}"
-                except Exception as e:
-                    logging.warning(f"PyPDF2 extraction failed: {e}")
+            # Tables are the most reliable source, so text is only extracted when none fit
+            tables_found = self._extract_pdf_tables(file_buffer)
             
             # Process extracted tables
             if tables_found:
                 best_table = self._find_best_data_table(tables_found)
                 if best_table:
-                    return self._process_dataframe(best_table['dataframe'], user_id, filename, 'pdf_table')
+                    df = pd.DataFrame(best_table['rows'], columns=best_table['header'])
+                    return self._process_dataframe(df, user_id, filename, 'pdf_table')
+            
+            text_content = "".join(
+                f"\n--- Page {page_num + 1} ---\n{page_text}"
+                for page_num, page_text in enumerate(self._extract_pdf_text(file_buffer))
+                if page_text
+            )
             
             # Process text content for sales data
             if text_content:
@@ -186,10 +451,105 @@ class EnhancedFileProcessor:
             logging.error(f"PDF processing error: {e}")
             return {"status": "error", "message": f"Error processing PDF: {str(e)}"}
     
-    def _process_docx_document(self, file_content: bytes, user_id: str, filename: str) -> Dict:
+    def _extract_pdf_tables(self, file_buffer: BinaryIO) -> List[Dict]:
+        """Extract tables from PDF pages with pdfplumber"""
+        tables_found = []
+        
+        try:
+            file_buffer.seek(0)
+            with pdfplumber.open(file_buffer) as pdf:
+                page_count = len(pdf.pages)
+                
+                if page_count < PDF_PARALLEL_MIN_PAGES or PDF_MAX_WORKERS < 2:
+                    raw_tables = _collect_page_tables(pdf.pages)
+                else:
+                    raw_tables = None
+            
+            # Long documents are split into page ranges parsed in worker processes
+            if raw_tables is None:
+                chunk_size = -(-page_count // PDF_MAX_WORKERS)
+                page_ranges = [
+                    list(range(start, min(start + chunk_size, page_count + 1)))
+                    for start in range(1, page_count + 1, chunk_size)
+                ]
+                results = _get_pdf_executor().map(
+                    _extract_page_tables, repeat(file_buffer.name), page_ranges
+                )
+                raw_tables = [table for result in results for table in result]
+            
+            # Kept as plain rows; only the winning table becomes a DataFrame
+            for page_number, table_number, table in raw_tables:
+                tables_found.append({
+                    'page': page_number,
+                    'table': table_number,
+                    'header': table[0],
+                    'rows': table[1:]
+                })
+            
+            logging.info(f"Extracted {len(tables_found)} tables from PDF")
+            
+        except Exception as e:
+            logging.warning(f"pdfplumber table extraction failed: {e}")
+        
+        return tables_found
+    
+    def _extract_pdf_text(self, file_buffer: BinaryIO) -> List[str]:
+        """Extract text for each page, empty where nothing could be extracted"""
+        text_parts = []
+        complete = False
+        
+        # Method 1: pypdfium2, much faster than pdfminer-based extraction
+        if pdfium is not None:
+            pdf = None
+            try:
+                file_buffer.seek(0)
+                pdf = pdfium.PdfDocument(file_buffer)
+                for page in pdf:
+                    textpage = page.get_textpage()
+                    text_parts.append(textpage.get_text_range() or "")
+                    textpage.close()
+                    page.close()
+                complete = True
+            except Exception as e:
+                logging.warning(f"pypdfium2 extraction failed: {e}")
+                text_parts = []
+            finally:
+                if pdf is not None:
+                    pdf.close()
+        
+        # Method 2: pdfplumber text when pypdfium2 is unavailable or failed
+        if not complete:
+            try:
+                # laparams stay unset: pdfminer layout analysis only runs when they are given.
+                # extract_text_simple skips the word clustering extract_text does
+                file_buffer.seek(0)
+                with pdfplumber.open(file_buffer) as pdf:
+                    for page in pdf.pages:
+                        text_parts.append(page.extract_text_simple(x_tolerance=3, y_tolerance=3) or "")
+                        page.close()
+                complete = True
+            except Exception as e:
+                logging.warning(f"pdfplumber text extraction failed: {e}")
+        
+        # Method 3: Fallback to PyPDF2, only for pages that got no text so far
+        if not complete or not all(text_parts):
+            try:
+                file_buffer.seek(0)
+                pdf_reader = PyPDF2.PdfReader(file_buffer)
+                text_parts.extend([""] * (len(pdf_reader.pages) - len(text_parts)))
+                
+                for page_num, page_text in enumerate(text_parts):
+                    if not page_text:
+                        text_parts[page_num] = pdf_reader.pages[page_num].extract_text() or ""
+            except Exception as e:
+                logging.warning(f"PyPDF2 extraction failed: {e}")
+        
+        return text_parts
+    
+    def _process_docx_document(self, file_buffer: BinaryIO, user_id: str, filename: str) -> Dict:
         """Process DOCX document and extract data"""
         try:
-            doc = Document(io.BytesIO(file_content))
+            doc = Document(file_buffer)
             
             # Extract text from paragraphs
             text_content = ""
@@ -199,20 +559,26 @@ class EnhancedFileProcessor:
             # Extract data from tables
             tables_data = []
             for table_num, table in enumerate(doc.tables):
-                table_data = []
-                for row in table.rows:
-                    row_data = [cell.text.strip() for cell in row.cells]
-                    table_data.append(row_data)
+                rows = table.rows
+                if len(rows) < 2:  # At least header + one row
+                    continue
                 
-                if len(table_data) > 1:  # At least header + one row
-                    try:
-                        df = pd.DataFrame(table_data[1:], columns=table_data[0])
-                        tables_data.append({
-                            'table_num': table_num + 1,
-                            'dataframe': df
-                        })
-                    except Exception as e:
-                        logging.warning(f"Could not convert table {table_num + 1} to DataFrame: {e}")
+                # A header without any sales keyword can never win _find_best_data_table,
+                # so the body of such tables is not read at all
+                header = [cell.text.strip() for cell in rows[0].cells]
+                if not _count_keywords(header, _SALES_KEYWORD_PATTERN):
+                    continue
+                
+                table_data = [[cell.text.strip() for cell in row.cells] for row in rows[1:]]
+                if any(len(row) != len(header) for row in table_data):
+                    logging.warning(f"Could not convert table {table_num + 1} to DataFrame: ragged rows")
+                    continue
+                
+                tables_data.append({
+                    'table_num': table_num + 1,
+                    'header': header,
+                    'rows': table_data
+                })
             
             logging.info(f"Extracted {len(tables_data)} tables from DOCX")
             
@@ -220,7 +586,8 @@ class EnhancedFileProcessor:
             if tables_data:
                 best_table = self._find_best_data_table(tables_data)
                 if best_table:
-                    return self._process_dataframe(best_table['dataframe'], user_id, filename, 'docx_table')
+                    df = pd.DataFrame(best_table['rows'], columns=best_table['header'])
+                    return self._process_dataframe(df, user_id, filename, 'docx_table')
             
             # Process text content for sales data
             if text_content.strip():
@@ -253,68 +620,72 @@ class EnhancedFileProcessor:
         """Extract sales data from plain text using regex patterns"""
         try:
             sales_data = []
-            lines = text.split('\n')
-            
-            # Patterns to match sales data
-            patterns = [
-                # Date Product Quantity Price Total
-                r'(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})\s+([^$\d]+?)\s+(\d+(?:\.\d+)?)\s+\$?(\d+(?:\.\d+)?)\s+\$?(\d+(?:\.\d+)?)',
-                # Product: $Amount on Date
-                r'([^:$\d]+?):\s*\$?(\d+(?:\.\d+)?)\s+(?:on|dated?)\s+(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
-                # Sold X Product for $Y
-                r'[Ss]old\s+(\d+(?:\.\d+)?)\s+([^$\d]+?)\s+(?:for|@)\s*\$?(\d+(?:\.\d+)?)',
-            ]
-            
-            for line in lines:
-                line = line.strip()
-                if not line or len(line) < 10:
+            now = datetime.utcnow()
+            
+            # Dates are parsed together once the scan is done
+            date_strings = []
+            dated_records = []
+            
+            # One scan over the whole text, dispatching on the pattern that matched
+            for match in _SALES_TEXT_PATTERN.finditer(text):
+                try:
+                    if match.lastgroup == 'full':
+                        sales_record = {
+                            'date': match.group('full_date'),
+                            'product_name': match.group('full_product').strip(),
+                            'quantity': float(match.group('full_qty')),
+                            'unit_price': float(match.group('full_price')),
+                            'total_amount': float(match.group('full_total')),
+                            'source': 'text_extraction'
+                        }
+                    elif match.lastgroup == 'dated':
+                        amount = float(match.group('dated_amount'))
+                        sales_record = {
+                            'date': match.group('dated_date'),
+                            'product_name': match.group('dated_product').strip(),
+                            'quantity': 1.0,
+                            'unit_price': amount,
+                            'total_amount': amount,
+                            'source': 'text_extraction'
+                        }
+                    else:
+                        qty = float(match.group('sold_qty'))
+                        amount = float(match.group('sold_amount'))
+                        sales_record = {
+                            'date': now,
+                            'product_name': match.group('sold_product').strip(),
+                            'quantity': qty,
+                            'unit_price': amount / qty,
+                            'total_amount': amount,
+                            'source': 'text_extraction'
+                        }
+                    
+                    # Validate record
+                    if (sales_record['total_amount'] > 0 and 
+                        sales_record['product_name'] and 
+                        len(sales_record['product_name']) > 1):
+                        sales_data.append(sales_record)
+                        if isinstance(sales_record['date'], str):
+                            date_strings.append(sales_record['date'])
+                            dated_records.append(sales_record)
+                        
+                except (ValueError, ZeroDivisionError) as e:
+                    logging.debug(f"Failed to parse match {match.group(0)!r}: {e}")
                     continue
+            
+            # Records whose date does not parse are dropped, as a failed parse did before
+            if dated_records:
+                dates = pd.to_datetime(date_strings, errors='coerce', format='mixed')
+                unparsed = set()
+                for sales_record, date in zip(dated_records, dates):
+                    if pd.isna(date):
+                        logging.debug(f"Failed to parse date {sales_record['date']!r}")
+                        unparsed.add(id(sales_record))
+                    else:
+                        sales_record['date'] = date.to_pydatetime()
                 
-                for pattern in patterns:
-                    matches = re.findall(pattern, line, re.IGNORECASE)
-                    for match in matches:
-                        try:
-                            if len(match) == 5:  # Full pattern
-                                date_str, product, qty, price, total = match
-                                sales_record = {
-                                    'date': pd.to_datetime(date_str).to_pydatetime(),
-                                    'product_name': product.strip(),
-                                    'quantity': float(qty),
-                                    'unit_price': float(price),
-                                    'total_amount': float(total),
-                                    'source': 'text_extraction'
-                                }
-                            elif len(match) == 3:  # Simplified patterns
-                                if re.search(r'\d{1,2}[/-]\d{1,2}', match[2]):  # Date is third
-                                    product, amount, date_str = match
-                                    sales_record = {
-                                        'date': pd.to_datetime(date_str).to_pydatetime(),
-                                        'product_name': product.strip(),
-                                        'quantity': 1.0,
-                                        'unit_price': float(amount),
-                                        'total_amount': float(amount),
-                                        'source': 'text_extraction'
-                                    }
-                                else:  # Quantity, product, amount
-                                    qty, product, amount = match
-                                    sales_record = {
-                                        'date': datetime.utcnow(),
-                                        'product_name': product.strip(),
-                                        'quantity': float(qty),
-                                        'unit_price': float(amount) / float(qty),
-                                        'total_amount': float(amount),
-                                        'source': 'text_extraction'
-                                    }
-                            
-                            # Validate record
-                            if (sales_record['total_amount'] > 0 and 
-                                sales_record['product_name'] and 
-                                len(sales_record['product_name']) > 1):
-                                sales_data.append(sales_record)
-                                
-                        except (ValueError, ZeroDivisionError) as e:
-                            logging.debug(f"Failed to parse match {match}: {e}")
-                            continue
+                if unparsed:
+                    sales_data = [record for record in sales_data if id(record) not in unparsed]
             
             logging.info(f"Extracted {len(sales_data)} sales records from text")
             return sales_data
@@ -324,29 +695,19 @@ class EnhancedFileProcessor:
             return []
     
     def _find_best_data_table(self, tables: List[Dict]) -> Optional[Dict]:
-        """Find the table most likely to contain sales data"""
+        """Find the table most likely to contain sales data, from its header and rows"""
         try:
             best_table = None
             best_score = 0
             
             for table_info in tables:
-                df = table_info['dataframe']
                 score = 0
                 
                 # Check for sales-related columns
-                column_str = ' '.join(df.columns.astype(str).str.lower())
-                sales_keywords = ['date', 'product', 'quantity', 'price', 'amount', 'total', 'sale', 'revenue']
-                
-                for keyword in sales_keywords:
-                    if keyword in column_str:
-                        score += 1
+                score += _count_keywords(table_info['header'], _SALES_KEYWORD_PATTERN)
                 
                 # Prefer tables with more rows
-                score += min(len(df), 10) * 0.1
-                
-                # Prefer tables with numeric columns
-                numeric_cols = df.select_dtypes(include=['number']).columns
-                score += len(numeric_cols) * 0.5
+                score += min(len(table_info['rows']), 10) * 0.1
                 
                 if score > best_score:
                     best_score = score
@@ -358,27 +719,23 @@ class EnhancedFileProcessor:
             logging.error(f"Error finding best table: {e}")
             return None
     
-    def _process_csv_enhanced(self, file_content: bytes, user_id: str, filename: str) -> Dict:
+    def _process_csv_enhanced(self, file_buffer: BinaryIO, user_id: str, filename: str) -> Dict:
         """Enhanced CSV processing with better error handling"""
         try:
-            # Try different encodings
-            encodings = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']
-            df = None
+            # Detect the encoding from a sample instead of decoding the whole file per guess
+            file_buffer.seek(0)
+            sample = file_buffer.read(CSV_ENCODING_SAMPLE_SIZE)
+            encoding = _detect_encoding(sample)
             
-            for encoding in encodings:
-                try:
-                    csv_string = file_content.decode(encoding)
-                    df = pd.read_csv(io.StringIO(csv_string))
-                    logging.info(f"Successfully read CSV with {encoding} encoding")
-                    break
-                except UnicodeDecodeError:
-                    continue
-                except Exception as e:
-                    logging.warning(f"Failed to read CSV with {encoding}: {e}")
-                    continue
+            try:
+                df = _read_csv(file_buffer, encoding)
+            except UnicodeDecodeError:
+                # latin-1 maps every byte, so this read cannot fail on decoding
+                logging.warning(f"CSV is not valid {encoding}, reading as latin-1")
+                encoding = 'latin-1'
+                df = _read_csv(file_buffer, encoding)
             
-            if df is None:
-                return {"status": "error", "message": "Could not read CSV file with any supported encoding"}
+            logging.info(f"Successfully read CSV with {encoding} encoding")
             
             return self._process_dataframe(df, user_id, filename, 'csv')
             
@@ -386,49 +743,40 @@ class EnhancedFileProcessor:
             logging.error(f"Enhanced CSV processing error: {e}")
             return {"status": "error", "message": f"Error reading CSV: {str(e)}"}
     
-    def _process_excel_enhanced(self, file_content: bytes, user_id: str, filename: str) -> Dict:
+    def _process_excel_enhanced(self, file_buffer: BinaryIO, user_id: str, filename: str) -> Dict:
         """Enhanced Excel processing with multiple sheet support"""
         try:
-            # Read all sheets
-            excel_file = pd.ExcelFile(io.BytesIO(file_content))
+            # Open the workbook once; every sheet is parsed from this handle
+            excel_file = pd.ExcelFile(file_buffer, engine=EXCEL_ENGINE)
             sheet_names = excel_file.sheet_names
             
             logging.info(f"Excel file has {len(sheet_names)} sheets: {sheet_names}")
             
-            # Try to find the best sheet with sales data
-            best_sheet = None
+            # Try to find the best sheet with sales data, scoring only its first rows
+            best_sheet_name = None
             best_score = 0
             
             for sheet_name in sheet_names:
                 try:
-                    df = pd.read_excel(io.BytesIO(file_content), sheet_name=sheet_name)
+                    df = excel_file.parse(sheet_name=sheet_name, nrows=EXCEL_SCORE_ROWS)
                     
                     # Score sheet based on sales-related content
-                    score = 0
-                    column_str = ' '.join(df.columns.astype(str).str.lower())
-                    sales_keywords = ['date', 'product', 'quantity', 'price', 'amount', 'total', 'sale']
-                    
-                    for keyword in sales_keywords:
-                        if keyword in column_str:
-                            score += 1
+                    score = _count_keywords(df.columns, _SALES_KEYWORD_PATTERN)
                     
                     # Prefer sheets with more data
-                    score += min(len(df), 50) * 0.01
+                    score += min(len(df), EXCEL_SCORE_ROWS) * 0.01
                     
                     if score > best_score:
                         best_score = score
-                        best_sheet = df
+                        best_sheet_name = sheet_name
                         
                 except Exception as e:
                     logging.warning(f"Could not read sheet {sheet_name}: {e}")
                     continue
             
-            if best_sheet is not None:
-                return self._process_dataframe(best_sheet, user_id, filename, 'excel')
-            else:
-                # Fallback to first sheet
-                df = pd.read_excel(io.BytesIO(file_content))
-                return self._process_dataframe(df, user_id, filename, 'excel')
+            # Only the winning sheet is read in full, falling back to the first sheet
+            df = excel_file.parse(sheet_name=best_sheet_name if best_sheet_name is not None else 0)
+            return self._process_dataframe(df, user_id, filename, 'excel')
             
         except Exception as e:
             logging.error(f"Enhanced Excel processing error: {e}")
@@ -481,18 +829,19 @@ class EnhancedFileProcessor:
     def _process_dataframe(self, df: pd.DataFrame, user_id: str, filename: str, file_type: str) -> Dict:
         """Process pandas DataFrame and extract sales data"""
         try:
-            # Clean column names
-            df.columns = df.columns.str.strip().str.lower()
+            # Clean column names once; the plain list is reused for every check below
+            columns = [str(col).strip().lower() for col in df.columns]
+            df.columns = columns
             
             # Log DataFrame info
             logging.info(f"Processing {file_type} file: {filename}")
-            logging.info(f"Columns: {list(df.columns)}")
+            logging.info(f"Columns: {columns}")
             logging.info(f"Rows: {len(df)}")
             
             # Detect data type based on columns
-            if self._is_sales_data(df.columns):
+            if self._is_sales_data(columns):
                 return self._process_sales_data(df, user_id, filename)
-            elif self._is_product_data(df.columns):
+            elif self._is_product_data(columns):
                 return self._process_product_data(df, user_id, filename)
             else:
                 return self._attempt_generic_processing(df, user_id, filename)
@@ -503,25 +852,11 @@ class EnhancedFileProcessor:
     
     def _is_sales_data(self, columns: List[str]) -> bool:
         """Check if DataFrame contains sales data"""
-        sales_indicators = [
-            'date', 'product', 'quantity', 'price', 'amount', 'total', 
-            'customer', 'sale', 'revenue', 'item'
-        ]
-        
-        column_str = ' '.join(columns)
-        matches = sum(1 for indicator in sales_indicators if indicator in column_str)
-        return matches >= 2
+        return _count_keywords(columns, _SALES_INDICATORS) >= 2
     
     def _is_product_data(self, columns: List[str]) -> bool:
         """Check if DataFrame contains product data"""
-        product_indicators = [
-            'product', 'name', 'price', 'cost', 'stock', 'inventory', 
-            'category', 'sku', 'description'
-        ]
-        
-        column_str = ' '.join(columns)
-        matches = sum(1 for indicator in product_indicators if indicator in column_str)
-        return matches >= 2
+        return _count_keywords(columns, _PRODUCT_INDICATORS) >= 2
     
     def _process_sales_data(self, df: pd.DataFrame, user_id: str, filename: str) -> Dict:
         """Process sales data from DataFrame"""
@@ -530,40 +865,59 @@ class EnhancedFileProcessor:
             sales_manager = SalesDataManager(self.db_manager)
             
             # Map columns to expected fields
-            column_mapping = self._create_sales_column_mapping(df.columns)
+            column_mapping = self._create_sales_column_mapping(df.columns.tolist())
+            
+            # Rows without a usable date are stamped with the upload time
+            default_date = pd.Timestamp(datetime.utcnow())
             
-            sales_records = []
+            # Extract and save in chunks so only one chunk of records is held at a time
+            result = {"total_processed": 0, "success_count": 0, "error_count": 0, "errors": []}
+            records_processed = 0
             errors = []
             
-            for index, row in df.iterrows():
-                try:
-                    sales_record = self._extract_sales_record(row, column_mapping)
-                    if sales_record:
-                        sales_records.append(sales_record)
-                    else:
-                        errors.append(f"Row {index + 1}: Could not extract valid sales data")
-                        
-                except Exception as e:
-                    errors.append(f"Row {index + 1}: {str(e)}")
+            chunks = (
+                df.iloc[chunk_start:chunk_start + SALES_SAVE_CHUNK_SIZE]
+                for chunk_start in range(0, len(df), SALES_SAVE_CHUNK_SIZE)
+            )
+            
+            # Each chunk is saved on a writer thread while the next one is extracted.
+            # Only one save is in flight, so at most two chunks of records are held.
+            with ThreadPoolExecutor(max_workers=1) as writer:
+                pending_save = None
+                
+                for chunk in chunks:
+                    sales_records, chunk_errors = self._extract_sales_records(chunk, column_mapping, default_date)
+                    
+                    if len(errors) < 10:
+                        errors.extend(chunk_errors[:10 - len(errors)])
+                    
+                    if not sales_records:
+                        continue
+                    
+                    # Save sales records
+                    if pending_save is not None:
+                        _merge_save_result(result, pending_save.result())
+                    pending_save = writer.submit(sales_manager.save_bulk_sales_data, user_id, sales_records)
+                    records_processed += len(sales_records)
+                
+                if pending_save is not None:
+                    _merge_save_result(result, pending_save.result())
             
-            if not sales_records:
+            if not records_processed:
                 return {
                     "status": "error",
                     "message": "No valid sales records found in file",
-                    "errors": errors[:10]  # Show first 10 errors
+                    "errors": errors  # Show first 10 errors
                 }
             
-            # Save sales records
-            result = sales_manager.save_bulk_sales_data(user_id, sales_records)
-            
             # Track file upload event
             if hasattr(self.db_manager, 'track_event'):
                 self.db_manager.track_event("file_upload", user_id, {
                     "filename": filename,
                     "type": "sales_data",
-                    "records_processed": len(sales_records),
-                    "success_count": result.get("success_count", 0),
-                    "error_count": result.get("error_count", 0)
+                    "records_processed": records_processed,
+                    "success_count": result["success_count"],
+                    "error_count": result["error_count"]
                 })
             
             return {
@@ -575,7 +929,7 @@ class EnhancedFileProcessor:
                     "total_processed": result["total_processed"],
                     "success_count": result["success_count"],
                     "error_count": result["error_count"],
-                    "errors": result["errors"][:5] if result["errors"] else []
+                    "errors": result["errors"]
                 }
             }
             
@@ -585,100 +939,78 @@ class EnhancedFileProcessor:
     
     def _create_sales_column_mapping(self, columns: List[str]) -> Dict:
         """Create mapping from DataFrame columns to sales record fields"""
-        mapping = {}
+        return dict(_sales_column_mapping(tuple(columns)))
+    
+    def _extract_sales_records(self, df: pd.DataFrame, column_mapping: Dict,
+                               default_date: pd.Timestamp) -> Tuple[List[Dict], List[str]]:
+        """Extract sales records from a DataFrame column by column"""
+        records = pd.DataFrame(index=df.index)
+        invalid = pd.Series(False, index=df.index)
         
-        # Common column name variations
-        date_cols = ['date', 'sale_date', 'transaction_date', 'order_date']
-        product_cols = ['product', 'product_name', 'item', 'item_name', 'name']
-        quantity_cols = ['quantity', 'qty', 'amount', 'units']
-        price_cols = ['price', 'unit_price', 'cost', 'rate']
-        total_cols = ['total', 'total_amount', 'revenue', 'sales', 'value']
-        customer_cols = ['customer', 'customer_name', 'client', 'buyer']
+        # Extract date
+        if 'date' in column_mapping:
+            raw = df[column_mapping['date']]
+            dates = pd.to_datetime(raw, errors='coerce')
+            
+            # Values in a different format than the rest of the column are parsed one by one
+            unparsed = dates.isna() & raw.notna()
+            if unparsed.any():
+                dates[unparsed] = raw[unparsed].map(lambda value: pd.to_datetime(value, errors='coerce'))
+                unparsed = dates.isna() & raw.notna()
+            
+            invalid |= unparsed
+            records['date'] = dates.fillna(default_date)
+        else:
+            records['date'] = default_date
         
-        for col in columns:
-            if any(date_col in col for date_col in date_cols):
-                mapping['date'] = col
-            elif any(product_col in col for product_col in product_cols):
-                mapping['product_name'] = col
-            elif any(qty_col in col for qty_col in quantity_cols):
-                mapping['quantity'] = col
-            elif any(price_col in col for price_col in price_cols):
-                mapping['unit_price'] = col
-            elif any(total_col in col for total_col in total_cols):
-                mapping['total_amount'] = col
-            elif any(customer_col in col for customer_col in customer_cols):
-                mapping['customer_name'] = col
+        # Extract product name
+        if 'product_name' in column_mapping:
+            records['product_name'] = _text_column(df[column_mapping['product_name']])
+        else:
+            records['product_name'] = "Unknown Product"
         
-        return mapping
-    
-    def _extract_sales_record(self, row: pd.Series, column_mapping: Dict) -> Optional[Dict]:
-        """Extract sales record from DataFrame row"""
-        try:
-            record = {}
-            
-            # Extract date
-            if 'date' in column_mapping:
-                date_value = row[column_mapping['date']]
-                if pd.notna(date_value):
-                    if isinstance(date_value, str):
-                        record['date'] = pd.to_datetime(date_value).to_pydatetime()
-                    else:
-                        record['date'] = date_value
-                else:
-                    record['date'] = datetime.utcnow()
-            else:
-                record['date'] = datetime.utcnow()
-            
-            # Extract product name
-            if 'product_name' in column_mapping:
-                product = row[column_mapping['product_name']]
-                record['product_name'] = str(product) if pd.notna(product) else ""
-            else:
-                record['product_name'] = "Unknown Product"
-            
-            # Extract quantity
-            if 'quantity' in column_mapping:
-                qty = row[column_mapping['quantity']]
-                record['quantity'] = float(qty) if pd.notna(qty) and qty != "" else 1.0
-            else:
-                record['quantity'] = 1.0
-            
-            # Extract unit price
-            if 'unit_price' in column_mapping:
-                price = row[column_mapping['unit_price']]
-                record['unit_price'] = float(price) if pd.notna(price) and price != "" else 0.0
-            else:
-                record['unit_price'] = 0.0
-            
-            # Extract total amount
-            if 'total_amount' in column_mapping:
-                total = row[column_mapping['total_amount']]
-                record['total_amount'] = float(total) if pd.notna(total) and total != "" else 0.0
-            else:
-                record['total_amount'] = record['quantity'] * record['unit_price']
-            
-            # Extract customer name
-            if 'customer_name' in column_mapping:
-                customer = row[column_mapping['customer_name']]
-                record['customer_name'] = str(customer) if pd.notna(customer) else ""
-            else:
-                record['customer_name'] = ""
-            
-            # Additional fields
-            record['source'] = 'file_upload'
-            record['category'] = 'general'
-            record['payment_method'] = 'unknown'
-            record['notes'] = f"Imported from file"
-            
-            # Validate record
-            if record['total_amount'] <= 0 and record['unit_price'] <= 0:
-                return None
-            
-            return record
-            
-        except Exception as e:
-            logging.error(f"Error extracting sales record: {e}")
-            return None
+        # Extract numeric fields, rejecting rows with values that are present but not numbers
+        for field, default in (('quantity', 1.0), ('unit_price', 0.0), ('total_amount', 0.0)):
+            if field in column_mapping:
+                raw = df[column_mapping[field]]
+                values = pd.to_numeric(raw, errors='coerce')
+                missing = raw.isna() | (raw == "")
+                invalid |= values.isna() & ~missing
+                records[field] = values.fillna(default).astype(float)
+            elif field != 'total_amount':
+                records[field] = default
+        
+        # Blank or non-positive totals are derived from quantity and unit price
+        line_totals = records['quantity'] * records['unit_price']
+        if 'total_amount' in records:
+            records['total_amount'] = records['total_amount'].where(records['total_amount'] > 0, line_totals)
+        else:
+            records['total_amount'] = line_totals
+        
+        # Extract customer name
+        if 'customer_name' in column_mapping:
+            records['customer_name'] = _text_column(df[column_mapping['customer_name']])
+        else:
+            records['customer_name'] = ""
+        
+        # Validate records
+        invalid |= (records['total_amount'] <= 0) & (records['unit_price'] <= 0)
+        
+        errors = [f"Row {index + 1}: Could not extract valid sales data" for index in df.index[invalid]]
+        
+        valid = records[~invalid]
+        if valid.empty:
+            return [], errors
+        
+        # Additional fields
+        valid = valid.assign(
+            source='file_upload',
+            category='general',
+            payment_method='unknown',
+            notes="Imported from file"
+        )
+        
+        return valid.to_dict('records'), errors
     
     def _process_product_data(self, df: pd.DataFrame, user_id: str, filename: str) -> Dict:
         """Process product data from DataFrame"""
@@ -694,17 +1026,16 @@ class EnhancedFileProcessor:
         # Implementation remains the same as before
         try:
             suggestions = []
-            numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-            date_cols = []
-            text_cols = df.select_dtypes(include=['object']).columns.tolist()
-            
-            # Try to find date columns
-            for col in text_cols:
-                try:
-                    pd.to_datetime(df[col].dropna().iloc[0])
-                    date_cols.append(col)
-                except:
-                    pass
+            # Bucket columns by dtype kind in one pass; 'O' covers object and str columns
+            numeric_cols, text_cols = [], []
+            for col, dtype in df.dtypes.items():
+                if dtype.kind in 'iufc':
+                    numeric_cols.append(col)
+                elif dtype.kind == 'O':
+                    text_cols.append(col)
+            
+            # Try to find date columns; with enough numeric columns one date column settles it
+            date_cols = _date_columns(df, text_cols, limit=1 if len(numeric_cols) >= 2 else None)
             
             if len(numeric_cols) >= 2 and len(text_cols) >= 1:
                 suggestions.append("This might be sales data. Expected columns: date, product_name, quantity, unit_price, total_amount")
@@ -1,21 +1,191 @@
+import codecs
+import itertools
+import numpy as np
 import pandas as pd
 import requests
+import shutil
+import tempfile
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
 from flask import current_app
-from typing import Dict, List, Any, Optional
-import io
+from typing import BinaryIO, Dict, Iterable, List, Any, Optional, Tuple
+import functools
 import json
+import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from ..utils.cache import TTLCache
+
+try:
+    import python_calamine
+except ImportError:  # Excel uploads use the pandas default engines
+    python_calamine = None
+
+# Rust-based reader for xlsx/xls when installed; None lets pandas pick openpyxl/xlrd
+EXCEL_ENGINE = 'calamine' if python_calamine is not None else None
+
+# Keep-alive session shared by media lookups and downloads
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504])
+))
+
+# Processed upload results by (media_id, user_id), kept for webhook redeliveries
+_RESULT_CACHE = TTLCache(maxsize=128, ttl=300)
+
+# Uploads up to this size stay in memory while downloading, larger ones spill to disk
+DOWNLOAD_SPOOL_SIZE = 8 * 1024 * 1024
+
+# Rows of an uploaded sales sheet converted and saved per batch
+SALES_SAVE_CHUNK_SIZE = 10000
+
+# Leading values of each text column parsed to decide whether it holds dates
+DATE_SAMPLE_ROWS = 50
+DATE_MIN_PARSED_FRACTION = 0.7
+
+# Rows read from an uploaded CSV at a time
+CSV_READ_CHUNK_SIZE = 50000
+
+# Bytes decoded per step when checking that an upload is valid UTF-8
+UTF8_CHECK_BLOCK_SIZE = 1 << 20
+
+# Words in column names that identify sales and product data
+_SALES_INDICATORS = re.compile('|'.join([
+    'date', 'product', 'quantity', 'price', 'amount', 'total',
+    'customer', 'sale', 'revenue', 'item'
+]))
+_PRODUCT_INDICATORS = re.compile('|'.join([
+    'product', 'name', 'price', 'cost', 'stock', 'inventory',
+    'category', 'sku', 'description'
+]))
+
+# Common column name variations for each sales record field, checked in order
+_SALES_COLUMN_PATTERNS = tuple(
+    (field, re.compile('|'.join(variations)))
+    for field, variations in [
+        ('date', ['date', 'sale_date', 'transaction_date', 'order_date']),
+        ('product_name', ['product', 'product_name', 'item', 'item_name', 'name']),
+        ('quantity', ['quantity', 'qty', 'amount', 'units']),
+        ('unit_price', ['price', 'unit_price', 'cost', 'rate']),
+        ('total_amount', ['total', 'total_amount', 'revenue', 'sales', 'value']),
+        ('customer_name', ['customer', 'customer_name', 'client', 'buyer']),
+    ]
+)
+
+
+def _count_keywords(columns, pattern: re.Pattern) -> int:
+    """Number of distinct keywords of pattern appearing anywhere in the column names"""
+    column_str = ' '.join(map(str, columns)).lower()
+    return len(set(pattern.findall(column_str)))
+
+
+def _is_utf8(file_buffer: BinaryIO) -> bool:
+    """Check that the whole file decodes as UTF-8 without holding the decoded text"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    file_buffer.seek(0)
+    try:
+        for block in iter(lambda: file_buffer.read(UTF8_CHECK_BLOCK_SIZE), b''):
+            decoder.decode(block)
+        decoder.decode(b'', final=True)
+        return True
+    except UnicodeDecodeError:
+        return False
+    finally:
+        file_buffer.seek(0)
+
+
+def _date_columns(df: pd.DataFrame, text_cols: List[str], limit: Optional[int] = None) -> List[str]:
+    """Text columns whose sampled values mostly parse as dates, stopping after limit of them"""
+    date_cols = []
+    for col, values in df[text_cols].head(DATE_SAMPLE_ROWS).items():
+        values = values.dropna()
+        if values.empty:
+            continue
+        
+        # Coercion turns unparseable values into NaT instead of raising per column
+        parsed = pd.to_datetime(values, errors='coerce', format='mixed')
+        if parsed.notna().mean() > DATE_MIN_PARSED_FRACTION:
+            date_cols.append(col)
+            if limit is not None and len(date_cols) >= limit:
+                break
+    return date_cols
+
+
+def _merge_save_result(result: Dict, chunk_result: Dict):
+    """Add one chunk's save counters to the running totals, keeping the first 5 errors"""
+    for key in ("total_processed", "success_count", "error_count"):
+        result[key] += chunk_result.get(key, 0)
+    if len(result["errors"]) < 5:
+        result["errors"].extend(chunk_result.get("errors", [])[:5 - len(result["errors"])])
+
+
+@functools.lru_cache(maxsize=256)
+def _sales_column_mapping(columns: Tuple[str, ...]) -> Tuple[Tuple[str, str], ...]:
+    """(field, column) pairs for a header; users re-upload the same export layout"""
+    mapping = {}
+    
+    # Column order matters, a later column matching the same field wins
+    for col in columns:
+        for field, pattern in _SALES_COLUMN_PATTERNS:
+            if pattern.search(col):
+                mapping[field] = col
+                break
+    
+    return tuple(mapping.items())
+
+
+def _text_column(raw: pd.Series) -> pd.Series:
+    """Convert a name column to str once per distinct value, with missing values as empty strings"""
+    codes, uniques = pd.factorize(raw)
+    
+    # Code -1 marks missing values and picks the trailing "" label
+    labels = np.array([str(value) for value in uniques] + [""], dtype=object)
+    return pd.Series(labels.take(codes), index=raw.index, dtype=object)
+
 
 class FileProcessor:
     """Process uploaded files from WhatsApp"""
     
+    # Processing method for each supported file extension
+    _HANDLERS = {
+        'csv': '_process_csv_data',
+        'xlsx': '_process_excel_data',
+        'xls': '_process_excel_data'
+    }
+    
+    # MIME type fragments checked in order when the extension is not recognised
+    _MIME_HANDLERS = (
+        ('csv', '_process_csv_data'),
+        ('excel', '_process_excel_data'),
+        ('spreadsheet', '_process_excel_data')
+    )
+    
     def __init__(self, db_manager):
         self.db_manager = db_manager
-        self.supported_formats = ['csv', 'xlsx', 'xls']
+        self.supported_formats = list(self._HANDLERS)
     
     def process_whatsapp_document(self, media_id: str, user_id: str) -> Dict:
         """Process document uploaded via WhatsApp"""
+        # Webhook redeliveries of the same upload reuse the first result instead of importing twice
+        cache_key = (media_id, user_id)
+        result = _RESULT_CACHE.get(cache_key)
+        if result is not None:
+            logging.info(f"Reusing processed result for media {media_id}")
+            return result
+        
+        result = self._process_whatsapp_document(media_id, user_id)
+        
+        # Errors are not cached so a retry can still succeed
+        if result.get("status") != "error":
+            _RESULT_CACHE.set(cache_key, result)
+        
+        return result
+    
+    def _process_whatsapp_document(self, media_id: str, user_id: str) -> Dict:
+        """Download and route a WhatsApp document to its processor"""
         try:
             # Download file from WhatsApp
             file_data = self._download_whatsapp_media(media_id)
@@ -27,15 +197,22 @@ class FileProcessor:
             filename = file_data.get('filename', '').lower()
             mime_type = file_data.get('mime_type', '').lower()
             
-            if filename.endswith('.csv') or 'csv' in mime_type:
-                return self._process_csv_data(file_data['content'], user_id, filename)
-            elif filename.endswith(('.xlsx', '.xls')) or 'excel' in mime_type or 'spreadsheet' in mime_type:
-                return self._process_excel_data(file_data['content'], user_id, filename)
-            else:
-                return {
-                    "status": "error", 
-                    "message": f"Unsupported file type. Please upload CSV or Excel files."
-                }
+            # Route to appropriate processor by extension, then by MIME type
+            handler_name = self._HANDLERS.get(filename.rpartition('.')[2]) if '.' in filename else None
+            if handler_name is None:
+                handler_name = next(
+                    (name for fragment, name in self._MIME_HANDLERS if fragment in mime_type), None
+                )
+            
+            # The spooled download is discarded once its processor returns
+            with file_data['content'] as file_buffer:
+                if handler_name is None:
+                    return {
+                        "status": "error", 
+                        "message": f"Unsupported file type. Please upload CSV or Excel files."
+                    }
+                
+                return getattr(self, handler_name)(file_buffer, user_id, filename)
                 
         except Exception as e:
             logging.error(f"File processing error: {e}")
@@ -50,7 +227,7 @@ class FileProcessor:
             
             # Get media URL
             url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{media_id}"
-            response = requests.get(url, headers=headers, timeout=30)
+            response = _SESSION.get(url, headers=headers, timeout=30)
             
             if response.status_code != 200:
                 logging.error(f"Failed to get media info: {response.status_code}")
@@ -63,72 +240,106 @@ class FileProcessor:
                 logging.error("No media URL in response")
                 return None
             
-            # Download actual file
-            file_response = requests.get(media_url, headers=headers, timeout=60)
+            # Stream the file into a spooled buffer handed to the parsers as-is
+            with _SESSION.get(media_url, headers=headers, stream=True, timeout=60) as file_response:
+                if file_response.status_code != 200:
+                    logging.error(f"Failed to download file: {file_response.status_code}")
+                    return None
+                
+                file_response.raw.decode_content = True
+                buffer = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE)
+                try:
+                    shutil.copyfileobj(file_response.raw, buffer, 64 * 1024)
+                except Exception:
+                    buffer.close()
+                    raise
             
-            if file_response.status_code != 200:
-                logging.error(f"Failed to download file: {file_response.status_code}")
-                return None
+            size = buffer.tell()
+            buffer.seek(0)
             
             return {
-                'content': file_response.content,
+                'content': buffer,
                 'mime_type': media_info.get('mime_type', ''),
                 'filename': media_info.get('filename', 'uploaded_file'),
-                'size': len(file_response.content)
+                'size': size
             }
             
         except Exception as e:
             logging.error(f"Error downloading WhatsApp media: {e}")
             return None
     
-    def _process_csv_data(self, file_content: bytes, user_id: str, filename: str) -> Dict:
+    def _process_csv_data(self, file_buffer: BinaryIO, user_id: str, filename: str) -> Dict:
         """Process CSV file data"""
         try:
-            # Read CSV data
-            csv_string = file_content.decode('utf-8')
-            df = pd.read_csv(io.StringIO(csv_string))
-            
-            return self._process_dataframe(df, user_id, filename, 'csv')
-            
-        except UnicodeDecodeError:
-            try:
-                # Try different encoding
-                csv_string = file_content.decode('latin-1')
-                df = pd.read_csv(io.StringIO(csv_string))
-                return self._process_dataframe(df, user_id, filename, 'csv')
-            except Exception as e:
-                logging.error(f"CSV encoding error: {e}")
-                return {"status": "error", "message": "Could not read CSV file. Please check file encoding."}
+            # Pick the encoding up front; sales chunks are saved as they are read,
+            # so a decode error halfway through could not be retried cleanly
+            encoding = 'utf-8' if _is_utf8(file_buffer) else 'latin-1'
+            
+            # Read CSV data in chunks; the first one decides how the file is handled
+            read_options = self._csv_read_options(file_buffer, encoding)
+            with pd.read_csv(file_buffer, encoding=encoding, chunksize=CSV_READ_CHUNK_SIZE, **read_options) as reader:
+                df = next(reader)
+                return self._process_dataframe(df, user_id, filename, 'csv', reader)
+            
         except Exception as e:
             logging.error(f"CSV processing error: {e}")
             return {"status": "error", "message": f"Error reading CSV: {str(e)}"}
     
-    def _process_excel_data(self, file_content: bytes, user_id: str, filename: str) -> Dict:
+    def _csv_read_options(self, file_buffer: BinaryIO, encoding: str) -> Dict:
+        """Column selection and text dtypes for a sales CSV, worked out from its header"""
+        header = pd.read_csv(file_buffer, encoding=encoding, nrows=0).columns
+        file_buffer.seek(0)
+        
+        columns = [str(col).strip().lower() for col in header]
+        if not self._is_sales_data(columns):
+            return {}
+        
+        # Columns matching neither an indicator nor a field pattern cannot change
+        # the detection or the mapping, so they are never parsed
+        mapping = self._create_sales_column_mapping(columns)
+        keep = {col for col in columns if _SALES_INDICATORS.search(col)} | set(mapping.values())
+        text_columns = {mapping[field] for field in ('product_name', 'customer_name') if field in mapping}
+        
+        return {
+            'usecols': lambda name: str(name).strip().lower() in keep,
+            'dtype': {raw: str for raw, col in zip(header, columns) if col in text_columns}
+        }
+    
+    def _process_excel_data(self, file_buffer: BinaryIO, user_id: str, filename: str) -> Dict:
         """Process Excel file data"""
         try:
             # Read Excel data
-            df = pd.read_excel(io.BytesIO(file_content))
+            df = pd.read_excel(file_buffer, engine=EXCEL_ENGINE)
             return self._process_dataframe(df, user_id, filename, 'excel')
             
         except Exception as e:
             logging.error(f"Excel processing error: {e}")
             return {"status": "error", "message": f"Error reading Excel file: {str(e)}"}
     
-    def _process_dataframe(self, df: pd.DataFrame, user_id: str, filename: str, file_type: str) -> Dict:
+    def _process_dataframe(self, df: pd.DataFrame, user_id: str, filename: str, file_type: str,
+                           more_chunks: Iterable[pd.DataFrame] = ()) -> Dict:
         """Process pandas DataFrame and extract sales data"""
         try:
-            # Clean column names
-            df.columns = df.columns.str.strip().str.lower()
+            # Clean column names once; the plain list is reused for every check below
+            columns = [str(col).strip().lower() for col in df.columns]
+            df.columns = columns
+            more_chunks = (chunk.set_axis(columns, axis=1) for chunk in more_chunks)
             
             # Log DataFrame info
             logging.info(f"Processing {file_type} file: {filename}")
-            logging.info(f"Columns: {list(df.columns)}")
+            logging.info(f"Columns: {columns}")
             logging.info(f"Rows: {len(df)}")
             
             # Detect data type based on columns
-            if self._is_sales_data(df.columns):
-                return self._process_sales_data(df, user_id, filename)
-            elif self._is_product_data(df.columns):
+            if self._is_sales_data(columns):
+                return self._process_sales_data(df, user_id, filename, more_chunks)
+            
+            # Product and generic handling look at the whole table
+            rest = list(more_chunks)
+            if rest:
+                df = pd.concat([df, *rest])
+            
+            if self._is_product_data(columns):
                 return self._process_product_data(df, user_id, filename)
             else:
                 return self._attempt_generic_processing(df, user_id, filename)
@@ -139,67 +350,74 @@ class FileProcessor:
     
     def _is_sales_data(self, columns: List[str]) -> bool:
         """Check if DataFrame contains sales data"""
-        sales_indicators = [
-            'date', 'product', 'quantity', 'price', 'amount', 'total', 
-            'customer', 'sale', 'revenue', 'item'
-        ]
-        
-        column_str = ' '.join(columns)
-        matches = sum(1 for indicator in sales_indicators if indicator in column_str)
-        return matches >= 2
+        return _count_keywords(columns, _SALES_INDICATORS) >= 2
     
     def _is_product_data(self, columns: List[str]) -> bool:
         """Check if DataFrame contains product data"""
-        product_indicators = [
-            'product', 'name', 'price', 'cost', 'stock', 'inventory', 
-            'category', 'sku', 'description'
-        ]
-        
-        column_str = ' '.join(columns)
-        matches = sum(1 for indicator in product_indicators if indicator in column_str)
-        return matches >= 2
+        return _count_keywords(columns, _PRODUCT_INDICATORS) >= 2
     
-    def _process_sales_data(self, df: pd.DataFrame, user_id: str, filename: str) -> Dict:
+    def _process_sales_data(self, df: pd.DataFrame, user_id: str, filename: str,
+                            more_chunks: Iterable[pd.DataFrame] = ()) -> Dict:
         """Process sales data from DataFrame"""
         try:
             from .sales_models import SalesDataManager
             sales_manager = SalesDataManager(self.db_manager)
             
             # Map columns to expected fields
-            column_mapping = self._create_sales_column_mapping(df.columns)
+            column_mapping = self._create_sales_column_mapping(df.columns.tolist())
             
-            sales_records = []
+            # Rows without a usable date are stamped with the upload time
+            default_date = pd.Timestamp(datetime.utcnow())
+            
+            # Extract and save in chunks so only one chunk of records is held at a time
+            result = {"total_processed": 0, "success_count": 0, "error_count": 0, "errors": []}
+            records_processed = 0
             errors = []
             
-            for index, row in df.iterrows():
-                try:
-                    sales_record = self._extract_sales_record(row, column_mapping)
-                    if sales_record:
-                        sales_records.append(sales_record)
-                    else:
-                        errors.append(f"Row {index + 1}: Could not extract valid sales data")
-                        
-                except Exception as e:
-                    errors.append(f"Row {index + 1}: {str(e)}")
-            
-            if not sales_records:
+            chunks = (
+                frame.iloc[chunk_start:chunk_start + SALES_SAVE_CHUNK_SIZE]
+                for frame in itertools.chain([df], more_chunks)
+                for chunk_start in range(0, len(frame), SALES_SAVE_CHUNK_SIZE)
+            )
+            
+            # Each chunk is saved on a writer thread while the next one is extracted.
+            # Only one save is in flight, so at most two chunks of records are held.
+            with ThreadPoolExecutor(max_workers=1) as writer:
+                pending_save = None
+                
+                for chunk in chunks:
+                    sales_records, chunk_errors = self._extract_sales_records(chunk, column_mapping, default_date)
+                    
+                    if len(errors) < 10:
+                        errors.extend(chunk_errors[:10 - len(errors)])
+                    
+                    if not sales_records:
+                        continue
+                    
+                    # Save sales records
+                    if pending_save is not None:
+                        _merge_save_result(result, pending_save.result())
+                    pending_save = writer.submit(sales_manager.save_bulk_sales_data, user_id, sales_records)
+                    records_processed += len(sales_records)
+                
+                if pending_save is not None:
+                    _merge_save_result(result, pending_save.result())
+            
+            if not records_processed:
                 return {
                     "status": "error",
                     "message": "No valid sales records found in file",
-                    "errors": errors[:10]  # Show first 10 errors
+                    "errors": errors  # Show first 10 errors
                 }
             
-            # Save sales records
-            result = sales_manager.save_bulk_sales_data(user_id, sales_records)
-            
             # Track file upload event
             if hasattr(self.db_manager, 'track_event'):
                 self.db_manager.track_event("file_upload", user_id, {
                     "filename": filename,
                     "type": "sales_data",
-                    "records_processed": len(sales_records),
-                    "success_count": result.get("success_count", 0),
-                    "error_count": result.get("error_count", 0)
+                    "records_processed": records_processed,
+                    "success_count": result["success_count"],
+                    "error_count": result["error_count"]
                 })
             
             return {
@@ -211,7 +429,7 @@ class FileProcessor:
                     "total_processed": result["total_processed"],
                     "success_count": result["success_count"],
                     "error_count": result["error_count"],
-                    "errors": result["errors"][:5] if result["errors"] else []
+                    "errors": result["errors"]
                 }
             }
             
@@ -221,100 +439,78 @@ class FileProcessor:
     
     def _create_sales_column_mapping(self, columns: List[str]) -> Dict:
         """Create mapping from DataFrame columns to sales record fields"""
-        mapping = {}
+        return dict(_sales_column_mapping(tuple(columns)))
+    
+    def _extract_sales_records(self, df: pd.DataFrame, column_mapping: Dict,
+                               default_date: pd.Timestamp) -> Tuple[List[Dict], List[str]]:
+        """Extract sales records from a DataFrame column by column"""
+        records = pd.DataFrame(index=df.index)
+        invalid = pd.Series(False, index=df.index)
         
-        # Common column name variations
-        date_cols = ['date', 'sale_date', 'transaction_date', 'order_date']
-        product_cols = ['product', 'product_name', 'item', 'item_name', 'name']
-        quantity_cols = ['quantity', 'qty', 'amount', 'units']
-        price_cols = ['price', 'unit_price', 'cost', 'rate']
-        total_cols = ['total', 'total_amount', 'revenue', 'sales', 'value']
-        customer_cols = ['customer', 'customer_name', 'client', 'buyer']
+        # Extract date
+        if 'date' in column_mapping:
+            raw = df[column_mapping['date']]
+            dates = pd.to_datetime(raw, errors='coerce')
+            
+            # Values in a different format than the rest of the column are parsed one by one
+            unparsed = dates.isna() & raw.notna()
+            if unparsed.any():
+                dates[unparsed] = raw[unparsed].map(lambda value: pd.to_datetime(value, errors='coerce'))
+                unparsed = dates.isna() & raw.notna()
+            
+            invalid |= unparsed
+            records['date'] = dates.fillna(default_date)
+        else:
+            records['date'] = default_date
         
-        for col in columns:
-            if any(date_col in col for date_col in date_cols):
-                mapping['date'] = col
-            elif any(product_col in col for product_col in product_cols):
-                mapping['product_name'] = col
-            elif any(qty_col in col for qty_col in quantity_cols):
-                mapping['quantity'] = col
-            elif any(price_col in col for price_col in price_cols):
-                mapping['unit_price'] = col
-            elif any(total_col in col for total_col in total_cols):
-                mapping['total_amount'] = col
-            elif any(customer_col in col for customer_col in customer_cols):
-                mapping['customer_name'] = col
+        # Extract product name
+        if 'product_name' in column_mapping:
+            records['product_name'] = _text_column(df[column_mapping['product_name']])
+        else:
+            records['product_name'] = "Unknown Product"
         
-        return mapping
-    
-    def _extract_sales_record(self, row: pd.Series, column_mapping: Dict) -> Optional[Dict]:
-        """Extract sales record from DataFrame row"""
-        try:
-            record = {}
-            
-            # Extract date
-            if 'date' in column_mapping:
-                date_value = row[column_mapping['date']]
-                if pd.notna(date_value):
-                    if isinstance(date_value, str):
-                        record['date'] = pd.to_datetime(date_value).to_pydatetime()
-                    else:
-                        record['date'] = date_value
-                else:
-                    record['date'] = datetime.utcnow()
-            else:
-                record['date'] = datetime.utcnow()
-            
-            # Extract product name
-            if 'product_name' in column_mapping:
-                product = row[column_mapping['product_name']]
-                record['product_name'] = str(product) if pd.notna(product) else ""
-            else:
-                record['product_name'] = "Unknown Product"
-            
-            # Extract quantity
-            if 'quantity' in column_mapping:
-                qty = row[column_mapping['quantity']]
-                record['quantity'] = float(qty) if pd.notna(qty) and qty != "" else 1.0
-            else:
-                record['quantity'] = 1.0
-            
-            # Extract unit price
-            if 'unit_price' in column_mapping:
-                price = row[column_mapping['unit_price']]
-                record['unit_price'] = float(price) if pd.notna(price) and price != "" else 0.0
-            else:
-                record['unit_price'] = 0.0
-            
-            # Extract total amount
-            if 'total_amount' in column_mapping:
-                total = row[column_mapping['total_amount']]
-                record['total_amount'] = float(total) if pd.notna(total) and total != "" else 0.0
-            else:
-                record['total_amount'] = record['quantity'] * record['unit_price']
-            
-            # Extract customer name
-            if 'customer_name' in column_mapping:
-                customer = row[column_mapping['customer_name']]
-                record['customer_name'] = str(customer) if pd.notna(customer) else ""
-            else:
-                record['customer_name'] = ""
-            
-            # Additional fields
-            record['source'] = 'csv_upload'
-            record['category'] = 'general'
-            record['payment_method'] = 'unknown'
-            record['notes'] = f"Imported from file"
-            
-            # Validate record
-            if record['total_amount'] <= 0 and record['unit_price'] <= 0:
-                return None
-            
-            return record
-            
-        except Exception as e:
-            logging.error(f"Error extracting sales record: {e}")
-            return None
+        # Extract numeric fields, rejecting rows with values that are present but not numbers
+        for field, default in (('quantity', 1.0), ('unit_price', 0.0), ('total_amount', 0.0)):
+            if field in column_mapping:
+                raw = df[column_mapping[field]]
+                values = pd.to_numeric(raw, errors='coerce')
+                missing = raw.isna() | (raw == "")
+                invalid |= values.isna() & ~missing
+                records[field] = values.fillna(default).astype(float)
+            elif field != 'total_amount':
+                records[field] = default
+        
+        # Blank or non-positive totals are derived from quantity and unit price
+        line_totals = records['quantity'] * records['unit_price']
+        if 'total_amount' in records:
+            records['total_amount'] = records['total_amount'].where(records['total_amount'] > 0, line_totals)
+        else:
+            records['total_amount'] = line_totals
+        
+        # Extract customer name
+        if 'customer_name' in column_mapping:
+            records['customer_name'] = _text_column(df[column_mapping['customer_name']])
+        else:
+            records['customer_name'] = ""
+        
+        # Validate records
+        invalid |= (records['total_amount'] <= 0) & (records['unit_price'] <= 0)
+        
+        errors = [f"Row {index + 1}: Could not extract valid sales data" for index in df.index[invalid]]
+        
+        valid = records[~invalid]
+        if valid.empty:
+            return [], errors
+        
+        # Additional fields
+        valid = valid.assign(
+            source='csv_upload',
+            category='general',
+            payment_method='unknown',
+            notes="Imported from file"
+        )
+        
+        return valid.to_dict('records'), errors
     
     def _process_product_data(self, df: pd.DataFrame, user_id: str, filename: str) -> Dict:
         """Process product data from DataFrame"""
@@ -339,18 +535,17 @@ class FileProcessor:
             # Analyze the data and provide suggestions
             suggestions = []
             
-            # Check if it might be sales data with different column names
-            numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-            date_cols = []
-            text_cols = df.select_dtypes(include=['object']).columns.tolist()
-            
-            # Try to find date columns
-            for col in text_cols:
-                try:
-                    pd.to_datetime(df[col].dropna().iloc[0])
-                    date_cols.append(col)
-                except:
-                    pass
+            # Check if it might be sales data with different column names,
+            # bucketing columns by dtype kind in one pass ('O' covers object and str)
+            numeric_cols, text_cols = [], []
+            for col, dtype in df.dtypes.items():
+                if dtype.kind in 'iufc':
+                    numeric_cols.append(col)
+                elif dtype.kind == 'O':
+                    text_cols.append(col)
+            
+            # Try to find date columns; with enough numeric columns one date column settles it
+            date_cols = _date_columns(df, text_cols, limit=1 if len(numeric_cols) >= 2 else None)
             
             if len(numeric_cols) >= 2 and len(text_cols) >= 1:
                 suggestions.append("This might be sales data. Expected columns: date, product_name, quantity, unit_price, total_amount")
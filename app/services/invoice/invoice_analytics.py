@@ -1,6 +1,22 @@
 import logging
-from typing import Dict, List
+from typing import Dict, List, Optional
 from datetime import datetime, timedelta
+from pymongo.errors import OperationFailure
+from ...models.database import INVOICE_PERIOD_INDEX
+from ...models.invoice_models import overdue_filter
+from .invoice_core import forget_invoices
+
+# Invoice fields read by the analytics pipelines, dropped to this right after $match
+ANALYTICS_PROJECTION = {'$project': {
+    '_id': 0,
+    'total_amount': 1,
+    'paid_amount': 1,
+    'status': 1,
+    'payment_status': 1,
+    'is_overdue': 1,
+    'created_at': 1,
+    'customer_id': 1
+}}
 
 class InvoiceAnalytics:
     """Invoice analytics and statistics"""
@@ -15,67 +31,14 @@ class InvoiceAnalytics:
             if not self.db_manager or not hasattr(self.db_manager, 'collections'):
                 return {}
             
-            # Date range
-            end_date = datetime.utcnow()
-            start_date = end_date - timedelta(days=period_days)
+            self.refresh_overdue_flags(user_id)
             
             # Aggregate statistics
-            pipeline = [
-                {'$match': {
-                    'user_id': user_id,
-                    'created_at': {'$gte': start_date, '$lte': end_date}
-                }},
-                {'$group': {
-                    '_id': None,
-                    'total_invoices': {'$sum': 1},
-                    'total_amount': {'$sum': '$total_amount'},
-                    'paid_amount': {'$sum': '$paid_amount'},
-                    'outstanding_amount': {'$sum': {'$subtract': ['$total_amount', '$paid_amount']}},
-                    'avg_invoice_amount': {'$avg': '$total_amount'},
-                    'draft_count': {
-                        '$sum': {'$cond': [{'$eq': ['$status', 'draft']}, 1, 0]}
-                    },
-                    'sent_count': {
-                        '$sum': {'$cond': [{'$eq': ['$status', 'sent']}, 1, 0]}
-                    },
-                    'paid_count': {
-                        '$sum': {'$cond': [{'$eq': ['$payment_status', 'paid']}, 1, 0]}
-                    },
-                    'overdue_count': {
-                        '$sum': {
-                            '$cond': [
-                                {
-                                    '$and': [
-                                        {'$lt': ['$due_date', datetime.utcnow()]},
-                                        {'$ne': ['$payment_status', 'paid']},
-                                        {'$ne': ['$status', 'cancelled']}
-                                    ]
-                                },
-                                1,
-                                0
-                            ]
-                        }
-                    }
-                }}
-            ]
+            pipeline = [self._period_match(user_id, period_days), ANALYTICS_PROJECTION] + self._stats_stages()
             
-            result = list(self.db_manager.collections['invoices'].aggregate(pipeline))
-            
-            if result:
-                stats = result[0]
-                stats.pop('_id', None)
-                
-                # Calculate additional metrics
-                if stats['total_invoices'] > 0:
-                    stats['payment_rate'] = (stats['paid_count'] / stats['total_invoices']) * 100
-                    stats['overdue_rate'] = (stats['overdue_count'] / stats['total_invoices']) * 100
-                else:
-                    stats['payment_rate'] = 0
-                    stats['overdue_rate'] = 0
-                
-                return stats
+            result = self._aggregate(pipeline)
             
-            return self._empty_stats()
+            return self._finish_stats(result)
             
         except Exception as e:
             self.logger.error(f"Error getting invoice stats: {e}")
@@ -87,35 +50,12 @@ class InvoiceAnalytics:
             if not self.db_manager or not hasattr(self.db_manager, 'collections'):
                 return {}
             
-            end_date = datetime.utcnow()
-            start_date = end_date - timedelta(days=period_days)
-            
             # Daily revenue aggregation
-            pipeline = [
-                {'$match': {
-                    'user_id': user_id,
-                    'created_at': {'$gte': start_date, '$lte': end_date}
-                }},
-                {'$group': {
-                    '_id': {
-                        'year': {'$year': '$created_at'},
-                        'month': {'$month': '$created_at'},
-                        'day': {'$dayOfMonth': '$created_at'}
-                    },
-                    'daily_revenue': {'$sum': '$total_amount'},
-                    'daily_paid': {'$sum': '$paid_amount'},
-                    'invoice_count': {'$sum': 1}
-                }},
-                {'$sort': {'_id': 1}}
-            ]
+            pipeline = [self._period_match(user_id, period_days), ANALYTICS_PROJECTION] + self._daily_trend_stages()
             
-            daily_data = list(self.db_manager.collections['invoices'].aggregate(pipeline))
+            daily_data = self._aggregate(pipeline)
             
-            return {
-                'daily_trends': daily_data,
-                'period_days': period_days,
-                'total_days': len(daily_data)
-            }
+            return self._finish_trends(daily_data, period_days)
             
         except Exception as e:
             self.logger.error(f"Error getting revenue trends: {e}")
@@ -128,32 +68,178 @@ class InvoiceAnalytics:
                 return {}
             
             # Customer aggregation
+            pipeline = [{'$match': {'user_id': user_id}}, ANALYTICS_PROJECTION] + self._customer_stages()
+            
+            customer_data = self._aggregate(pipeline)
+            
+            return self._finish_customers(customer_data)
+            
+        except Exception as e:
+            self.logger.error(f"Error getting customer analytics: {e}")
+            return {}
+    
+    def get_dashboard(self, user_id: str, period_days: int = 30) -> Dict:
+        """Get stats, daily trends and top customers for one period in a single aggregation"""
+        try:
+            if not self.db_manager or not hasattr(self.db_manager, 'collections'):
+                return {}
+            
+            self.refresh_overdue_flags(user_id)
+            
+            # $facet runs all three sub-pipelines over the same matched invoices
             pipeline = [
-                {'$match': {'user_id': user_id}},
-                {'$group': {
-                    '_id': '$customer_id',
-                    'total_invoices': {'$sum': 1},
-                    'total_amount': {'$sum': '$total_amount'},
-                    'paid_amount': {'$sum': '$paid_amount'},
-                    'avg_invoice_amount': {'$avg': '$total_amount'},
-                    'first_invoice': {'$min': '$created_at'},
-                    'last_invoice': {'$max': '$created_at'}
-                }},
-                {'$sort': {'total_amount': -1}},
-                {'$limit': 10}
+                self._period_match(user_id, period_days),
+                ANALYTICS_PROJECTION,
+                {'$facet': {
+                    'stats': self._stats_stages(),
+                    'daily': self._daily_trend_stages(),
+                    'customers': self._customer_stages()
+                }}
             ]
             
-            customer_data = list(self.db_manager.collections['invoices'].aggregate(pipeline))
+            result = self._aggregate(pipeline)
+            facets = result[0] if result else {}
             
             return {
-                'top_customers': customer_data,
-                'total_unique_customers': len(customer_data)
+                'stats': self._finish_stats(facets.get('stats', [])),
+                'revenue_trends': self._finish_trends(facets.get('daily', []), period_days),
+                'customer_analytics': self._finish_customers(facets.get('customers', []))
             }
             
         except Exception as e:
-            self.logger.error(f"Error getting customer analytics: {e}")
+            self.logger.error(f"Error getting invoice dashboard: {e}")
             return {}
     
+    def refresh_overdue_flags(self, user_id: Optional[str] = None) -> int:
+        """Flag invoices whose due date has passed since they were last saved"""
+        try:
+            if not self.db_manager or not hasattr(self.db_manager, 'collections'):
+                return 0
+            
+            # Saves already store is_overdue; only the passage of time can make it stale,
+            # and only towards True, so a single update_many keeps it current
+            query = {'is_overdue': {'$ne': True}, **overdue_filter(datetime.utcnow())}
+            if user_id:
+                query['user_id'] = user_id
+            
+            result = self.db_manager.collections['invoices'].update_many(query, {'$set': {'is_overdue': True}})
+            if result.modified_count:
+                forget_invoices(user_id)
+            return result.modified_count
+            
+        except Exception as e:
+            self.logger.error(f"Error refreshing overdue flags: {e}")
+            return 0
+    
+    def _aggregate(self, pipeline: List[Dict]) -> List[Dict]:
+        """Run an invoices pipeline on the (user_id, created_at) index"""
+        collection = self.db_manager.collections['invoices']
+        try:
+            return list(collection.aggregate(pipeline, hint=INVOICE_PERIOD_INDEX))
+        except OperationFailure as e:
+            self.logger.warning(f"Invoice period index unavailable, aggregating without hint: {e}")
+            return list(collection.aggregate(pipeline))
+    
+    def _period_match(self, user_id: str, period_days: int) -> Dict:
+        """Match a user's invoices created in the last period_days"""
+        end_date = datetime.utcnow()
+        start_date = end_date - timedelta(days=period_days)
+        
+        return {'$match': {
+            'user_id': user_id,
+            'created_at': {'$gte': start_date, '$lte': end_date}
+        }}
+    
+    def _stats_stages(self) -> List[Dict]:
+        """Pipeline stages computing invoice totals and status counts"""
+        return [
+            {'$group': {
+                '_id': None,
+                'total_invoices': {'$sum': 1},
+                'total_amount': {'$sum': '$total_amount'},
+                'paid_amount': {'$sum': '$paid_amount'},
+                'outstanding_amount': {'$sum': {'$subtract': ['$total_amount', '$paid_amount']}},
+                'avg_invoice_amount': {'$avg': '$total_amount'},
+                'draft_count': {
+                    '$sum': {'$cond': [{'$eq': ['$status', 'draft']}, 1, 0]}
+                },
+                'sent_count': {
+                    '$sum': {'$cond': [{'$eq': ['$status', 'sent']}, 1, 0]}
+                },
+                'paid_count': {
+                    '$sum': {'$cond': [{'$eq': ['$payment_status', 'paid']}, 1, 0]}
+                },
+                'overdue_count': {
+                    '$sum': {'$cond': ['$is_overdue', 1, 0]}
+                }
+            }}
+        ]
+    
+    def _daily_trend_stages(self) -> List[Dict]:
+        """Pipeline stages grouping revenue by creation day"""
+        return [
+            {'$group': {
+                '_id': {
+                    'year': {'$year': '$created_at'},
+                    'month': {'$month': '$created_at'},
+                    'day': {'$dayOfMonth': '$created_at'}
+                },
+                'daily_revenue': {'$sum': '$total_amount'},
+                'daily_paid': {'$sum': '$paid_amount'},
+                'invoice_count': {'$sum': 1}
+            }},
+            {'$sort': {'_id': 1}}
+        ]
+    
+    def _customer_stages(self) -> List[Dict]:
+        """Pipeline stages ranking the top 10 customers by invoiced amount"""
+        return [
+            {'$group': {
+                '_id': '$customer_id',
+                'total_invoices': {'$sum': 1},
+                'total_amount': {'$sum': '$total_amount'},
+                'paid_amount': {'$sum': '$paid_amount'},
+                'avg_invoice_amount': {'$avg': '$total_amount'},
+                'first_invoice': {'$min': '$created_at'},
+                'last_invoice': {'$max': '$created_at'}
+            }},
+            {'$sort': {'total_amount': -1}},
+            {'$limit': 10}
+        ]
+    
+    def _finish_stats(self, result: List[Dict]) -> Dict:
+        """Add rate metrics to the grouped stats, or return empty stats"""
+        if not result:
+            return self._empty_stats()
+        
+        stats = result[0]
+        stats.pop('_id', None)
+        
+        # Calculate additional metrics
+        if stats['total_invoices'] > 0:
+            stats['payment_rate'] = (stats['paid_count'] / stats['total_invoices']) * 100
+            stats['overdue_rate'] = (stats['overdue_count'] / stats['total_invoices']) * 100
+        else:
+            stats['payment_rate'] = 0
+            stats['overdue_rate'] = 0
+        
+        return stats
+    
+    def _finish_trends(self, daily_data: List[Dict], period_days: int) -> Dict:
+        """Wrap daily revenue rows"""
+        return {
+            'daily_trends': daily_data,
+            'period_days': period_days,
+            'total_days': len(daily_data)
+        }
+    
+    def _finish_customers(self, customer_data: List[Dict]) -> Dict:
+        """Wrap top customer rows"""
+        return {
+            'top_customers': customer_data,
+            'total_unique_customers': len(customer_data)
+        }
+    
     def _empty_stats(self) -> Dict:
         """Return empty statistics"""
         return {
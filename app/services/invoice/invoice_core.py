@@ -1,11 +1,65 @@
 import logging
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
+import random
+import re
+import time
 import uuid
+from flask import g, has_request_context
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from ...models.invoice_models import (
     Invoice, InvoiceItem, InvoiceStatus, PaymentStatus, RecurrenceType
 )
 
+# Attempts at a read-modify-write before giving up on a contended invoice
+UPDATE_ATTEMPTS = 3
+UPDATE_RETRY_DELAY = 0.05
+
+# Enum value lookups for building invoices, skipping the Enum call machinery
+INVOICE_STATUSES = InvoiceStatus._value2member_map_
+RECURRENCE_TYPES = RecurrenceType._value2member_map_
+
+# Sequence part of a generated invoice number, e.g. INV-202401-0007
+INVOICE_NUMBER_RE = re.compile(r'^INV-\d{6}-(\d+)$')
+
+# Fields carried over when an invoice is duplicated
+DUPLICATE_FIELDS = ('customer_id', 'items', 'notes', 'terms', 'currency')
+
+
+def _request_invoice_cache() -> Optional[Dict]:
+    """Invoice documents read during the current request, or None outside a request
+    
+    Scoped to the request so one message's handlers share reads without ever
+    seeing another request's, or another worker's, stale copy.
+    """
+    if not has_request_context():
+        return None
+    if 'invoice_cache' not in g:
+        g.invoice_cache = {}
+    return g.invoice_cache
+
+
+def forget_invoice(user_id: str, invoice_id: str):
+    """Drop an invoice from the request cache after writing it"""
+    cache = _request_invoice_cache()
+    if cache is not None:
+        cache.pop((user_id, invoice_id), None)
+
+
+def forget_invoices(user_id: Optional[str] = None):
+    """Drop a user's cached invoices, or all of them, after a multi-document write"""
+    cache = _request_invoice_cache()
+    if cache is not None:
+        for cache_key in [key for key in cache if user_id is None or key[0] == user_id]:
+            del cache[cache_key]
+
+
+def wait_before_retry(attempt: int):
+    """Jittered backoff before retry number attempt, so retrying writers do not collide again"""
+    time.sleep(random.uniform(0, UPDATE_RETRY_DELAY * attempt))
+
+
 class InvoiceCoreService:
     """Core invoice operations - CRUD operations"""
     
@@ -21,39 +75,23 @@ class InvoiceCoreService:
             if not invoice_number:
                 invoice_number = self._generate_invoice_number(user_id)
             
-            # Create invoice object
-            invoice = Invoice(
-                invoice_number=invoice_number,
-                customer_id=invoice_data.get('customer_id', ''),
-                issue_date=invoice_data.get('issue_date', datetime.utcnow()),
-                due_date=invoice_data.get('due_date', datetime.utcnow() + timedelta(days=30)),
-                status=InvoiceStatus(invoice_data.get('status', 'draft')),
-                notes=invoice_data.get('notes', ''),
-                terms=invoice_data.get('terms', ''),
-                currency=invoice_data.get('currency', 'USD'),
-                is_recurring=invoice_data.get('is_recurring', False),
-                recurrence_type=RecurrenceType(invoice_data.get('recurrence_type', 'none'))
-            )
-            
-            # Add items
-            if invoice_data.get('items'):
-                for item_data in invoice_data['items']:
-                    item = InvoiceItem.from_dict(item_data)
-                    invoice.items.append(item)
-            
-            # Calculate totals
-            invoice.calculate_totals()
-            
-            # Set up recurrence
-            if invoice.is_recurring:
-                invoice.generate_next_invoice_date()
+            invoice = self.build_invoice(invoice_data, invoice_number)
             
             # Save to database
             if self.db_manager and hasattr(self.db_manager, 'collections'):
                 invoice_doc = invoice.to_dict()
                 invoice_doc['user_id'] = user_id
                 
-                result = self.db_manager.collections['invoices'].insert_one(invoice_doc)
+                try:
+                    result = self.db_manager.collections['invoices'].insert_one(invoice_doc)
+                except DuplicateKeyError:
+                    if invoice_data.get('invoice_number'):
+                        raise
+                    
+                    # A concurrent create took this number; draw a fresh one once
+                    invoice.invoice_number = self._generate_invoice_number(user_id)
+                    invoice_doc['invoice_number'] = invoice.invoice_number
+                    result = self.db_manager.collections['invoices'].insert_one(invoice_doc)
                 if result.inserted_id:
                     self.logger.info(f"Invoice created: {invoice.invoice_number}")
                     return invoice
@@ -64,16 +102,53 @@ class InvoiceCoreService:
             self.logger.error(f"Error creating invoice: {e}")
             return None
     
+    def build_invoice(self, invoice_data: Dict, invoice_number: str) -> Invoice:
+        """Build an unsaved invoice with computed totals from raw invoice data"""
+        now = datetime.utcnow()
+        invoice = Invoice(
+            invoice_number=invoice_number,
+            customer_id=invoice_data.get('customer_id', ''),
+            issue_date=invoice_data.get('issue_date', now),
+            due_date=invoice_data.get('due_date', now + timedelta(days=30)),
+            status=INVOICE_STATUSES[invoice_data.get('status', 'draft')],
+            notes=invoice_data.get('notes', ''),
+            terms=invoice_data.get('terms', ''),
+            currency=invoice_data.get('currency', 'USD'),
+            is_recurring=invoice_data.get('is_recurring', False),
+            recurrence_type=RECURRENCE_TYPES[invoice_data.get('recurrence_type', 'none')]
+        )
+        
+        # Add items
+        if invoice_data.get('items'):
+            item_from_dict = InvoiceItem.from_dict
+            invoice.items.extend([item_from_dict(item_data) for item_data in invoice_data['items']])
+        
+        # Calculate totals
+        invoice.calculate_totals()
+        
+        # Set up recurrence
+        if invoice.is_recurring:
+            invoice.generate_next_invoice_date()
+        
+        return invoice
+    
     def get_invoice(self, user_id: str, invoice_id: str) -> Optional[Invoice]:
         """Get invoice by ID"""
         try:
             if not self.db_manager or not hasattr(self.db_manager, 'collections'):
                 return None
             
-            invoice_doc = self.db_manager.collections['invoices'].find_one({
-                'user_id': user_id,
-                'id': invoice_id
-            })
+            # The raw document is cached; each caller gets its own Invoice to modify
+            cache = _request_invoice_cache()
+            cache_key = (user_id, invoice_id)
+            invoice_doc = cache.get(cache_key) if cache is not None else None
+            if invoice_doc is None:
+                invoice_doc = self.db_manager.collections['invoices'].find_one({
+                    'user_id': user_id,
+                    'id': invoice_id
+                })
+                if invoice_doc and cache is not None:
+                    cache[cache_key] = invoice_doc
             
             if invoice_doc:
                 return Invoice.from_dict(invoice_doc)
@@ -110,32 +185,72 @@ class InvoiceCoreService:
             if not self.db_manager or not hasattr(self.db_manager, 'collections'):
                 return False
             
-            # Get current invoice to recalculate if items changed
-            invoice = self.get_invoice(user_id, invoice_id)
-            if not invoice:
-                return False
-            
-            # Apply updates
-            for key, value in updates.items():
-                if hasattr(invoice, key):
-                    setattr(invoice, key, value)
+            for attempt in range(UPDATE_ATTEMPTS):
+                if attempt:
+                    wait_before_retry(attempt)
+                
+                # Get current invoice to recalculate if items changed
+                invoice = self.get_invoice(user_id, invoice_id)
+                if not invoice:
+                    return False
+                
+                # Apply updates
+                for key, value in updates.items():
+                    if hasattr(invoice, key):
+                        setattr(invoice, key, value)
+                
+                # Recalculate totals if items were updated
+                if 'items' in updates:
+                    invoice.calculate_totals()
+                
+                if self.save_invoice(user_id, invoice):
+                    return True
             
-            # Recalculate totals if items were updated
-            if 'items' in updates:
-                invoice.calculate_totals()
+            self.logger.warning(f"Invoice {invoice_id} kept changing, update abandoned")
+            return False
             
-            invoice.updated_at = datetime.utcnow()
+        except Exception as e:
+            self.logger.error(f"Error updating invoice: {e}")
+            return False
+    
+    def save_invoice(self, user_id: str, invoice: Invoice) -> bool:
+        """Write back an invoice read earlier, unless it was saved by someone else since"""
+        old_version = invoice.version
+        invoice.version = old_version + 1
+        invoice.updated_at = datetime.utcnow()
+        
+        # Invoices saved before versioning have no version field at all
+        version_filter = old_version if old_version else {'$in': [0, None]}
+        
+        result = self.db_manager.collections['invoices'].update_one(
+            {'user_id': user_id, 'id': invoice.id, 'version': version_filter},
+            {'$set': invoice.to_dict()}
+        )
+        # Also on a miss, so a retry reads the newer version
+        forget_invoice(user_id, invoice.id)
+        
+        if result.modified_count > 0:
+            return True
+        
+        invoice.version = old_version
+        return False
+    
+    def partial_update(self, user_id: str, invoice_id: str, fields: Dict) -> bool:
+        """Set stored fields directly, for changes that need no recalculation"""
+        try:
+            if not self.db_manager or not hasattr(self.db_manager, 'collections'):
+                return False
             
-            # Save back to database
+            # Bumping the version makes concurrent save_invoice calls re-read
             result = self.db_manager.collections['invoices'].update_one(
                 {'user_id': user_id, 'id': invoice_id},
-                {'$set': invoice.to_dict()}
+                {'$set': {**fields, 'updated_at': datetime.utcnow()}, '$inc': {'version': 1}}
             )
-            
-            return result.modified_count > 0
+            forget_invoice(user_id, invoice_id)
+            return result.matched_count > 0
             
         except Exception as e:
-            self.logger.error(f"Error updating invoice: {e}")
+            self.logger.error(f"Error updating invoice fields: {e}")
             return False
     
     def delete_invoice(self, user_id: str, invoice_id: str) -> bool:
@@ -145,17 +260,18 @@ class InvoiceCoreService:
                 return False
             
             # Only allow deletion of draft invoices
-            invoice = self.get_invoice(user_id, invoice_id)
-            if not invoice or invoice.status != InvoiceStatus.DRAFT:
-                self.logger.warning(f"Cannot delete invoice {invoice_id}: not in draft status")
-                return False
-            
             result = self.db_manager.collections['invoices'].delete_one({
                 'user_id': user_id,
-                'id': invoice_id
+                'id': invoice_id,
+                'status': InvoiceStatus.DRAFT.value
             })
+            forget_invoice(user_id, invoice_id)
+            
+            if result.deleted_count == 0:
+                self.logger.warning(f"Cannot delete invoice {invoice_id}: not in draft status")
+                return False
             
-            return result.deleted_count > 0
+            return True
             
         except Exception as e:
             self.logger.error(f"Error deleting invoice: {e}")
@@ -164,19 +280,18 @@ class InvoiceCoreService:
     def duplicate_invoice(self, user_id: str, invoice_id: str) -> Optional[Invoice]:
         """Create a copy of an existing invoice"""
         try:
-            original_invoice = self.get_invoice(user_id, invoice_id)
-            if not original_invoice:
+            if not self.db_manager or not hasattr(self.db_manager, 'collections'):
+                return None
+            
+            # Read only the copied fields; the stored item dicts go straight into create_invoice
+            new_invoice_data = self.db_manager.collections['invoices'].find_one(
+                {'user_id': user_id, 'id': invoice_id},
+                {'_id': 0, **{field: 1 for field in DUPLICATE_FIELDS}}
+            )
+            if not new_invoice_data:
                 return None
             
-            # Create new invoice data from original
-            new_invoice_data = {
-                'customer_id': original_invoice.customer_id,
-                'items': [item.to_dict() for item in original_invoice.items],
-                'notes': original_invoice.notes,
-                'terms': original_invoice.terms,
-                'currency': original_invoice.currency,
-                'status': 'draft'  # Always create as draft
-            }
+            new_invoice_data['status'] = 'draft'  # Always create as draft
             
             return self.create_invoice(user_id, new_invoice_data)
             
@@ -190,35 +305,64 @@ class InvoiceCoreService:
             if not self.db_manager or not hasattr(self.db_manager, 'collections'):
                 return f"INV-{datetime.utcnow().strftime('%Y%m%d')}-{uuid.uuid4().hex[:6].upper()}"
             
-            # Get current year and month
-            now = datetime.utcnow()
-            year_month = now.strftime('%Y%m')
-            
-            # Find highest number for this month
-            query = {
-                'user_id': user_id,
-                'invoice_number': {'$regex': f'^INV-{year_month}'}
-            }
-            
-            cursor = self.db_manager.collections['invoices'].find(query).sort('invoice_number', -1).limit(1)
-            
-            last_invoice = None
-            for doc in cursor:
-                last_invoice = doc
-                break
-            
-            if last_invoice:
-                # Extract number and increment
-                last_number = last_invoice['invoice_number'].split('-')[-1]
-                try:
-                    next_number = int(last_number) + 1
-                    return f"INV-{year_month}-{next_number:04d}"
-                except ValueError:
-                    pass
-            
-            # First invoice of the month
-            return f"INV-{year_month}-0001"
+            return self.reserve_invoice_numbers(user_id, 1)[0]
             
         except Exception as e:
             self.logger.error(f"Error generating invoice number: {e}")
-            return f"INV-{datetime.utcnow().strftime('%Y%m%d')}-{uuid.uuid4().hex[:6].upper()}"
\ No newline at end of file
+            return f"INV-{datetime.utcnow().strftime('%Y%m%d')}-{uuid.uuid4().hex[:6].upper()}"
+    
+    def reserve_invoice_numbers(self, user_id: str, count: int) -> List[str]:
+        """Draw count consecutive invoice numbers for the current month in one counter update"""
+        # Get current year and month
+        now = datetime.utcnow()
+        year_month = now.strftime('%Y%m')
+        
+        counters = self.db_manager.collections.get('invoice_counters')
+        if counters is None:
+            first_number = self._last_invoice_sequence(user_id, year_month) + 1
+            return [f"INV-{year_month}-{number:04d}" for number in range(first_number, first_number + count)]
+        
+        # Atomic per-month counter, so concurrent creates never read the same last number
+        counter_filter = {'user_id': user_id, 'period': year_month}
+        counter = counters.find_one_and_update(
+            counter_filter,
+            {'$inc': {'seq': count}},
+            projection={'_id': 0, 'seq': 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        
+        if counter['seq'] == count:
+            # New counter: continue after numbers issued before counters existed
+            last_number = self._last_invoice_sequence(user_id, year_month)
+            if last_number:
+                counter = counters.find_one_and_update(
+                    counter_filter,
+                    {'$inc': {'seq': last_number}},
+                    projection={'_id': 0, 'seq': 1},
+                    return_document=ReturnDocument.AFTER
+                )
+        
+        last_reserved = counter['seq']
+        return [f"INV-{year_month}-{number:04d}" for number in range(last_reserved - count + 1, last_reserved + 1)]
+    
+    def _last_invoice_sequence(self, user_id: str, year_month: str) -> int:
+        """Highest sequence number used in a month's invoice numbers, 0 if none"""
+        # Prefix as a range ('~' sorts after every digit), so it is a plain index range scan
+        prefix = f'INV-{year_month}-'
+        query = {
+            'user_id': user_id,
+            'invoice_number': {'$gte': prefix, '$lt': f'{prefix}~'}
+        }
+        
+        cursor = self.db_manager.collections['invoices'].find(
+            query, {'_id': 0, 'invoice_number': 1}
+        ).sort('invoice_number', -1).limit(1)
+        
+        for doc in cursor:
+            # Extract number
+            match = INVOICE_NUMBER_RE.match(doc['invoice_number'])
+            if match:
+                return int(match.group(1))
+        
+        return 0
\ No newline at end of file
@@ -1,7 +1,17 @@
 import logging
+import re
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
-from ...models.invoice_models import Invoice, InvoiceStatus, PaymentStatus
+from ...models.invoice_models import Invoice, InvoiceStatus, PaymentStatus, overdue_filter
+
+# Only the fields Invoice.from_dict reads are fetched from MongoDB
+INVOICE_PROJECTION = {'_id': 0, **{name: 1 for name in Invoice.__dataclass_fields__}}
+
+# Maximum number of invoices returned by a search
+SEARCH_LIMIT = 50
+
+# Search terms shorter than this use a regex match instead of $text
+MIN_TEXT_SEARCH_LENGTH = 3
 
 class InvoiceQueryService:
     """Invoice query and search operations"""
@@ -31,18 +41,13 @@ class InvoiceQueryService:
                 if filters.get('date_to'):
                     query.setdefault('issue_date', {})['$lte'] = filters['date_to']
                 if filters.get('overdue_only'):
-                    query['due_date'] = {'$lt': datetime.utcnow()}
-                    query['payment_status'] = {'$ne': 'paid'}
-                    query['status'] = {'$ne': 'cancelled'}
-            
-            invoices = []
-            cursor = self.db_manager.collections['invoices'].find(query).sort('created_at', -1).skip(skip).limit(limit)
+                    query.update(overdue_filter(datetime.utcnow()))
             
-            for invoice_doc in cursor:
-                invoice = Invoice.from_dict(invoice_doc)
-                invoices.append(invoice)
+            # One batch per page, so a page is a single round trip
+            cursor = self.db_manager.collections['invoices'].find(query, INVOICE_PROJECTION).sort('created_at', -1).skip(skip).limit(limit).batch_size(limit)
             
-            return invoices
+            from_dict = Invoice.from_dict
+            return [from_dict(invoice_doc) for invoice_doc in cursor]
             
         except Exception as e:
             self.logger.error(f"Error listing invoices: {e}")
@@ -54,25 +59,35 @@ class InvoiceQueryService:
             if not self.db_manager or not hasattr(self.db_manager, 'collections'):
                 return []
             
-            # Build search query
-            query = {
-                'user_id': user_id,
-                '$or': [
-                    {'invoice_number': {'$regex': search_term, '$options': 'i'}},
-                    {'notes': {'$regex': search_term, '$options': 'i'}},
-                    {'customer.name': {'$regex': search_term, '$options': 'i'}},
-                    {'customer.company': {'$regex': search_term, '$options': 'i'}}
-                ]
-            }
+            collection = self.db_manager.collections['invoices']
             
-            invoices = []
-            cursor = self.db_manager.collections['invoices'].find(query).sort('created_at', -1).limit(50)
+            if len(search_term) < MIN_TEXT_SEARCH_LENGTH:
+                # Too short for useful words; scan the user's invoices with a regex
+                pattern = re.compile(re.escape(search_term), re.IGNORECASE)
+                query = {
+                    'user_id': user_id,
+                    '$or': [
+                        {'invoice_number': pattern},
+                        {'notes': pattern},
+                        {'customer.name': pattern},
+                        {'customer.company': pattern}
+                    ]
+                }
+                cursor = collection.find(query, INVOICE_PROJECTION).sort('created_at', -1)
+            else:
+                # Full-text search served by the invoice_text index
+                query = {
+                    'user_id': user_id,
+                    '$text': {'$search': search_term}
+                }
+                cursor = collection.find(
+                    query, {**INVOICE_PROJECTION, 'score': {'$meta': 'textScore'}}
+                ).sort([('score', {'$meta': 'textScore'})])
             
-            for invoice_doc in cursor:
-                invoice = Invoice.from_dict(invoice_doc)
-                invoices.append(invoice)
+            cursor = cursor.limit(SEARCH_LIMIT).batch_size(SEARCH_LIMIT)
             
-            return invoices
+            from_dict = Invoice.from_dict
+            return [from_dict(invoice_doc) for invoice_doc in cursor]
             
         except Exception as e:
             self.logger.error(f"Error searching invoices: {e}")
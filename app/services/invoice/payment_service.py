@@ -2,7 +2,7 @@ import logging
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 from ...models.invoice_models import Invoice, Payment, PaymentStatus
-from .invoice_core import InvoiceCoreService
+from .invoice_core import InvoiceCoreService, forget_invoice
 
 class PaymentService:
     """Payment management for invoices"""
@@ -15,27 +15,12 @@ class PaymentService:
     def add_payment(self, user_id: str, invoice_id: str, payment_data: Dict) -> bool:
         """Add payment to invoice"""
         try:
-            invoice = self.invoice_core.get_invoice(user_id, invoice_id)
-            if not invoice:
+            if not self.db_manager or not hasattr(self.db_manager, 'collections'):
                 return False
             
-            payment = Payment(
-                amount=payment_data.get('amount', 0.0),
-                payment_date=payment_data.get('payment_date', datetime.utcnow()),
-                payment_method=payment_data.get('payment_method', ''),
-                transaction_id=payment_data.get('transaction_id', ''),
-                notes=payment_data.get('notes', '')
-            )
-            
-            invoice.add_payment(payment)
+            payment = self._make_payment(payment_data)
             
-            # Update invoice in database
-            return self.invoice_core.update_invoice(user_id, invoice_id, {
-                'payments': [p.to_dict() for p in invoice.payments],
-                'paid_amount': invoice.paid_amount,
-                'payment_status': invoice.payment_status.value,
-                'status': invoice.status.value
-            })
+            return self._apply_payment(user_id, invoice_id, payment)
             
         except Exception as e:
             self.logger.error(f"Error adding payment: {e}")
@@ -56,18 +41,22 @@ class PaymentService:
     def mark_as_paid(self, user_id: str, invoice_id: str, payment_data: Dict = None) -> bool:
         """Mark invoice as fully paid"""
         try:
-            invoice = self.invoice_core.get_invoice(user_id, invoice_id)
-            if not invoice:
+            if not self.db_manager or not hasattr(self.db_manager, 'collections'):
                 return False
             
-            remaining_amount = invoice.total_amount - invoice.paid_amount
+            payment = self._make_payment(payment_data or {})
             
-            if remaining_amount > 0:
-                payment_info = payment_data or {}
-                payment_info['amount'] = remaining_amount
-                return self.add_payment(user_id, invoice_id, payment_info)
+            # The remaining balance is computed and paid in the same update that records it
+            remaining_amount = {'$subtract': ['$total_amount', {'$ifNull': ['$paid_amount', 0]}]}
+            outstanding = {'$expr': {'$gt': [remaining_amount, 0]}}
+            if self._apply_payment(user_id, invoice_id, payment, outstanding, remaining_amount):
+                return True
             
-            return True
+            # Nothing left to pay counts as success, a missing or cancelled invoice does not
+            invoice_doc = self.db_manager.collections['invoices'].find_one(
+                {'user_id': user_id, 'id': invoice_id, 'status': {'$ne': 'cancelled'}}, {'_id': 1}
+            )
+            return invoice_doc is not None
             
         except Exception as e:
             self.logger.error(f"Error marking invoice as paid: {e}")
@@ -76,12 +65,7 @@ class PaymentService:
     def refund_payment(self, user_id: str, invoice_id: str, refund_amount: float, refund_reason: str = "") -> bool:
         """Process a refund for an invoice"""
         try:
-            invoice = self.invoice_core.get_invoice(user_id, invoice_id)
-            if not invoice:
-                return False
-            
-            if refund_amount > invoice.paid_amount:
-                self.logger.error(f"Refund amount exceeds paid amount")
+            if not self.db_manager or not hasattr(self.db_manager, 'collections'):
                 return False
             
             # Create refund payment (negative amount)
@@ -92,15 +76,68 @@ class PaymentService:
                 notes=f"Refund: {refund_reason}"
             )
             
-            invoice.add_payment(refund_payment)
+            # Only refund invoices that have at least that much paid
+            if not self._apply_payment(user_id, invoice_id, refund_payment, {'paid_amount': {'$gte': refund_amount}}):
+                self.logger.error(f"Refund not applied: invoice not found or refund exceeds paid amount")
+                return False
             
-            # Update invoice
-            return self.invoice_core.update_invoice(user_id, invoice_id, {
-                'payments': [p.to_dict() for p in invoice.payments],
-                'paid_amount': invoice.paid_amount,
-                'payment_status': invoice.payment_status.value
-            })
+            return True
             
         except Exception as e:
             self.logger.error(f"Error processing refund: {e}")
-            return False
\ No newline at end of file
+            return False
+    
+    def _make_payment(self, payment_data: Dict) -> Payment:
+        """Build a payment from request data"""
+        return Payment(
+            amount=payment_data.get('amount', 0.0),
+            payment_date=payment_data.get('payment_date', datetime.utcnow()),
+            payment_method=payment_data.get('payment_method', ''),
+            transaction_id=payment_data.get('transaction_id', ''),
+            notes=payment_data.get('notes', '')
+        )
+    
+    def _apply_payment(self, user_id: str, invoice_id: str, payment: Payment,
+                       conditions: Dict = None, amount: Any = None) -> bool:
+        """Record a payment in a single update, deriving payment status and status in the database
+        
+        amount may be an aggregation expression evaluated against the stored
+        invoice; it defaults to payment.amount.
+        """
+        query = {'user_id': user_id, 'id': invoice_id, 'status': {'$ne': 'cancelled'}}
+        query.update(conditions or {})
+        
+        if amount is None:
+            amount = payment.amount
+        
+        # Field values are literals, except the amount which may be an expression
+        payment_doc = {name: {'$literal': value} for name, value in payment.to_dict().items()}
+        payment_doc['amount'] = amount
+        
+        fully_paid = {'$eq': ['$payment_status', 'paid']}
+        
+        # Pipeline update, so concurrent payments add up instead of overwriting each other
+        pipeline = [
+            {'$set': {
+                'payments': {'$concatArrays': [{'$ifNull': ['$payments', []]}, [payment_doc]]},
+                'paid_amount': {'$add': [{'$ifNull': ['$paid_amount', 0]}, amount]},
+                'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]},
+                'updated_at': datetime.utcnow()
+            }},
+            # Same rules as Invoice.calculate_totals and Invoice.add_payment
+            {'$set': {'payment_status': {'$switch': {
+                'branches': [
+                    {'case': {'$eq': ['$paid_amount', 0]}, 'then': 'pending'},
+                    {'case': {'$gte': ['$paid_amount', '$total_amount']}, 'then': 'paid'}
+                ],
+                'default': 'partial'
+            }}}},
+            {'$set': {
+                'status': {'$cond': [fully_paid, 'paid', '$status']},
+                'is_overdue': {'$cond': [fully_paid, False, '$is_overdue']}
+            }}
+        ]
+        
+        result = self.db_manager.collections['invoices'].update_one(query, pipeline)
+        forget_invoice(user_id, invoice_id)
+        return result.matched_count > 0
\ No newline at end of file
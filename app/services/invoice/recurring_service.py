@@ -1,8 +1,42 @@
 import logging
+import itertools
+from collections import defaultdict
 from typing import Dict, List
 from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 from ...models.invoice_models import Invoice, RecurrenceType
-from .invoice_core import InvoiceCoreService
+from .invoice_core import InvoiceCoreService, RECURRENCE_TYPES, forget_invoice
+from .invoice_query import INVOICE_PROJECTION
+
+# Invoices fetched per round trip when scanning recurring invoices
+RECURRING_BATCH_SIZE = 500
+
+# Template fields needed to issue the next invoice of a recurring invoice
+RECURRING_TEMPLATE_PROJECTION = {
+    'user_id': 1,
+    'id': 1,
+    'customer_id': 1,
+    'items': 1,
+    'notes': 1,
+    'terms': 1,
+    'currency': 1,
+    'is_recurring': 1,
+    'recurrence_type': 1,
+    'recurrence_end_date': 1,
+    'next_invoice_date': 1
+}
+
+
+def _batches(iterable, size: int):
+    """Yield lists of up to size items from iterable"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
 
 class RecurringInvoiceService:
     """Recurring invoice automation"""
@@ -18,73 +52,125 @@ class RecurringInvoiceService:
             if not self.db_manager or not hasattr(self.db_manager, 'collections'):
                 return 0
             
+            now = datetime.utcnow()
+            
             # Find invoices due for recurrence
             query = {
                 'is_recurring': True,
-                'next_invoice_date': {'$lte': datetime.utcnow()},
+                'next_invoice_date': {'$lte': now},
                 'recurrence_type': {'$ne': 'none'},
                 'status': {'$ne': 'cancelled'}
             }
             
-            cursor = self.db_manager.collections['invoices'].find(query)
+            collection = self.db_manager.collections['invoices']
+            cursor = collection.find(query, RECURRING_TEMPLATE_PROJECTION).batch_size(RECURRING_BATCH_SIZE)
+            
+            # Issue each fetched batch before pulling the next one
             processed_count = 0
+            for template_docs in _batches(cursor, RECURRING_BATCH_SIZE):
+                processed_count += self._process_recurring_batch(collection, template_docs, now)
             
-            for invoice_doc in cursor:
+            self.logger.info(f"Created {processed_count} recurring invoices")
+            return processed_count
+            
+        except Exception as e:
+            self.logger.error(f"Error processing recurring invoices: {e}")
+            return 0
+    
+    def _process_recurring_batch(self, collection, template_docs: List[Dict], now: datetime) -> int:
+        """Issue the next invoice for a batch of due templates and advance their dates"""
+        # Skip templates whose recurrence has ended
+        due_invoices = []
+        for invoice_doc in template_docs:
+            try:
+                original_invoice = Invoice.from_dict(invoice_doc)
+            except Exception as e:
+                self.logger.error(f"Error processing recurring invoice {invoice_doc.get('id')}: {e}")
+                continue
+            
+            if original_invoice.recurrence_end_date and now > original_invoice.recurrence_end_date:
+                continue
+            due_invoices.append((invoice_doc, original_invoice))
+        
+        if not due_invoices:
+            return 0
+        
+        # One counter update per user covers all of that user's new invoice numbers
+        by_user = defaultdict(list)
+        for invoice_doc, original_invoice in due_invoices:
+            by_user[invoice_doc['user_id']].append((invoice_doc, original_invoice))
+        
+        new_docs = []
+        templates = []
+        for user_id, user_invoices in by_user.items():
+            invoice_numbers = self.invoice_core.reserve_invoice_numbers(user_id, len(user_invoices))
+            
+            for invoice_number, (invoice_doc, original_invoice) in zip(invoice_numbers, user_invoices):
                 try:
                     # Create new invoice from template
-                    original_invoice = Invoice.from_dict(invoice_doc)
-                    
-                    # Check if recurrence has ended
-                    if (original_invoice.recurrence_end_date and 
-                        datetime.utcnow() > original_invoice.recurrence_end_date):
-                        continue
-                    
                     new_invoice_data = {
                         'customer_id': original_invoice.customer_id,
-                        'items': [item.to_dict() for item in original_invoice.items],
+                        'items': invoice_doc.get('items', []),
                         'notes': original_invoice.notes,
                         'terms': original_invoice.terms,
                         'currency': original_invoice.currency,
                         'is_recurring': True,
                         'recurrence_type': original_invoice.recurrence_type.value
                     }
+                    new_doc = self.invoice_core.build_invoice(new_invoice_data, invoice_number).to_dict()
+                    new_doc['user_id'] = user_id
                     
-                    # Create new invoice
-                    new_invoice = self.invoice_core.create_invoice(invoice_doc['user_id'], new_invoice_data)
-                    
-                    if new_invoice:
-                        # Update original invoice next date
-                        original_invoice.generate_next_invoice_date()
-                        self.invoice_core.update_invoice(
-                            invoice_doc['user_id'], 
-                            original_invoice.id, 
-                            {'next_invoice_date': original_invoice.next_invoice_date}
-                        )
-                        
-                        processed_count += 1
-                        self.logger.info(f"Created recurring invoice: {new_invoice.invoice_number}")
-                
+                    original_invoice.generate_next_invoice_date()
                 except Exception as e:
                     self.logger.error(f"Error processing recurring invoice {invoice_doc.get('id')}: {e}")
                     continue
-            
-            return processed_count
-            
-        except Exception as e:
-            self.logger.error(f"Error processing recurring invoices: {e}")
+                
+                new_docs.append(new_doc)
+                templates.append((invoice_doc, original_invoice))
+        
+        if not new_docs:
             return 0
+        
+        # Insert all new invoices in one batch; a failed insert leaves its template due
+        failed = set()
+        try:
+            collection.insert_many(new_docs, ordered=False)
+        except BulkWriteError as e:
+            failed = {error['index'] for error in e.details.get('writeErrors', [])}
+            for index in sorted(failed):
+                self.logger.error(f"Error processing recurring invoice {templates[index][0].get('id')}: insert failed")
+        
+        # Advance the next date of every template whose invoice was created
+        date_updates = []
+        for index, (invoice_doc, original_invoice) in enumerate(templates):
+            if index in failed:
+                continue
+            
+            date_updates.append(UpdateOne(
+                {'_id': invoice_doc['_id']},
+                {'$set': {'next_invoice_date': original_invoice.next_invoice_date, 'updated_at': now},
+                 '$inc': {'version': 1}}
+            ))
+        
+        if date_updates:
+            collection.bulk_write(date_updates, ordered=False)
+            for invoice_doc, original_invoice in templates:
+                forget_invoice(invoice_doc['user_id'], invoice_doc['id'])
+        
+        return len(date_updates)
     
     def setup_recurring_invoice(self, user_id: str, invoice_id: str, recurrence_config: Dict) -> bool:
         """Set up recurring schedule for an invoice"""
         try:
-            updates = {
+            # Scalar fields only, so they are set in place without reading the invoice
+            fields = {
                 'is_recurring': True,
-                'recurrence_type': recurrence_config.get('type', 'monthly'),
+                'recurrence_type': RECURRENCE_TYPES[recurrence_config.get('type', 'monthly')].value,
                 'recurrence_end_date': recurrence_config.get('end_date'),
                 'next_invoice_date': recurrence_config.get('next_date', datetime.utcnow() + timedelta(days=30))
             }
             
-            return self.invoice_core.update_invoice(user_id, invoice_id, updates)
+            return self.invoice_core.partial_update(user_id, invoice_id, fields)
             
         except Exception as e:
             self.logger.error(f"Error setting up recurring invoice: {e}")
@@ -93,13 +179,13 @@ class RecurringInvoiceService:
     def stop_recurring_invoice(self, user_id: str, invoice_id: str) -> bool:
         """Stop recurring schedule for an invoice"""
         try:
-            updates = {
+            fields = {
                 'is_recurring': False,
-                'recurrence_type': 'none',
+                'recurrence_type': RecurrenceType.NONE.value,
                 'next_invoice_date': None
             }
             
-            return self.invoice_core.update_invoice(user_id, invoice_id, updates)
+            return self.invoice_core.partial_update(user_id, invoice_id, fields)
             
         except Exception as e:
             self.logger.error(f"Error stopping recurring invoice: {e}")
@@ -117,14 +203,10 @@ class RecurringInvoiceService:
                 'status': {'$ne': 'cancelled'}
             }
             
-            invoices = []
-            cursor = self.db_manager.collections['invoices'].find(query).sort('next_invoice_date', 1)
-            
-            for invoice_doc in cursor:
-                invoice = Invoice.from_dict(invoice_doc)
-                invoices.append(invoice)
+            cursor = self.db_manager.collections['invoices'].find(query, INVOICE_PROJECTION).sort('next_invoice_date', 1).batch_size(RECURRING_BATCH_SIZE)
             
-            return invoices
+            from_dict = Invoice.from_dict
+            return [from_dict(invoice_doc) for invoice_doc in cursor]
             
         except Exception as e:
             self.logger.error(f"Error getting recurring invoices: {e}")
@@ -79,10 +79,13 @@ class InvoiceService:
         """List invoices with filters"""
         invoices = self.query.list_invoices(user_id, filters, limit, skip)
         
-        # Load customer information for each invoice
-        for invoice in invoices:
-            if invoice.customer_id and not invoice.customer:
-                invoice.customer = self.customer_service.get_customer(user_id, invoice.customer_id)
+        # Load customer information for the whole page in one query
+        customer_ids = {invoice.customer_id for invoice in invoices if invoice.customer_id and not invoice.customer}
+        if customer_ids:
+            customers = self.customer_service.get_customers_by_ids(user_id, customer_ids)
+            for invoice in invoices:
+                if invoice.customer_id and not invoice.customer:
+                    invoice.customer = customers.get(invoice.customer_id)
         
         return invoices
     
@@ -124,6 +127,14 @@ class InvoiceService:
         """Get customer analytics"""
         return self.analytics.get_customer_analytics(user_id)
     
+    def get_invoice_dashboard(self, user_id: str, period_days: int = 30) -> Dict:
+        """Get stats, revenue trends and top customers in one query"""
+        return self.analytics.get_dashboard(user_id, period_days)
+    
+    def refresh_overdue_flags(self, user_id: str = None) -> int:
+        """Flag invoices that became overdue since they were saved"""
+        return self.analytics.refresh_overdue_flags(user_id)
+    
     # Recurring Operations (delegate to recurring service)
     def process_recurring_invoices(self) -> int:
         """Process recurring invoices"""
@@ -2,7 +2,7 @@ import requests
 import logging
 from flask import current_app
 from typing import Dict, List, Optional
-import json
+from ..utils.json_utils import dumps_context
 
 class OpenRouterService:
     """OpenRouter AI service with free models for business intelligence responses"""
@@ -57,7 +57,7 @@ class OpenRouterService:
             # Prepare context information
             context_info = ""
             if context:
-                context_info = f"\nUser Context: {json.dumps(context, default=str)}"
+                context_info = f"\nUser Context: {dumps_context(context)}"
             
             payload = {
                 "model": self.model,
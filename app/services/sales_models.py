@@ -8,6 +8,9 @@ import logging
 from typing import Dict, List, Optional
 from datetime import datetime
 
+import numpy as np
+import pandas as pd
+
 
 class SalesDataManager:
     """Manages sales data records and operations"""
@@ -45,6 +48,72 @@ class SalesDataManager:
         logging.info("Using stub implementation for sales data")
         return True
     
+    def get_sales_frame(
+        self, 
+        user_id: str, 
+        start_date: datetime = None, 
+        end_date: datetime = None, 
+        limit: int = 2000
+    ) -> pd.DataFrame:
+        """
+        Load sales dates and amounts as a DataFrame in a single cursor pass
+        
+        Args:
+            user_id: User ID
+            start_date: Earliest sale date (optional)
+            end_date: Latest sale date (optional)
+            limit: Maximum number of records to load; the most recent are kept
+            
+        Returns:
+            DataFrame with 'date' and 'total_amount' columns, oldest first
+        """
+        empty = pd.DataFrame({'date': pd.Series(dtype='datetime64[ns]'), 
+                              'total_amount': pd.Series(dtype='float64')})
+        
+        if not (self.db_enabled and self.db_manager and self.db_manager.collections):
+            return empty
+        
+        try:
+            query = {"user_id": user_id, "data_type": "sales_record"}
+            if start_date or end_date:
+                date_filter = {}
+                if start_date:
+                    date_filter["$gte"] = start_date
+                if end_date:
+                    date_filter["$lte"] = end_date
+                query["data_value.date"] = date_filter
+            
+            cursor = (
+                self.db_manager.collections['business_data']
+                .find(query, {"_id": 0, "data_value.date": 1, "data_value.total_amount": 1})
+                .sort("data_value.date", -1)
+                .batch_size(500)
+                .limit(limit)
+            )
+            
+            # Fill preallocated buffers straight from the cursor, newest first
+            dates = np.empty(limit, dtype=object)
+            amounts = np.full(limit, np.nan)
+            count = 0
+            for doc in cursor:
+                record = doc.get("data_value", {})
+                dates[count] = record.get("date")
+                try:
+                    amounts[count] = float(record.get("total_amount"))
+                except (TypeError, ValueError):
+                    pass
+                count += 1
+            
+            # Reverse so the frame reads oldest first
+            return pd.DataFrame({
+                'date': pd.to_datetime(dates[:count][::-1], errors='coerce'),
+                'total_amount': amounts[:count][::-1]
+            })
+            
+        except Exception as e:
+            logging.error(f"Error loading sales frame: {e}")
+            return empty
+    
     def get_sales_summary(self, user_id: str, days: int = 30) -> Dict:
         """Get sales summary for user"""
         logging.info(f"Getting sales summary for {user_id} (last {days} days)")
@@ -0,0 +1,65 @@
+import logging
+import threading
+import time
+
+
+class CircuitBreaker:
+    """Fail fast after repeated upstream failures.
+
+    After ``fail_max`` consecutive failures the breaker opens and rejects calls
+    for ``reset_timeout`` seconds. It then lets a single trial call through
+    (half-open); success closes the breaker, failure opens it again. A trial
+    that reports nothing within ``reset_timeout`` is abandoned and a new one
+    is let through.
+
+    Every call that ``allow_request`` admits must end in ``record_success`` or
+    ``record_failure``, whatever way it exits.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, fail_max: int = 5, reset_timeout: float = 60.0):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """Return True if a call may be attempted now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            # _opened_at is when the breaker opened, or when the current trial started
+            now = time.monotonic()
+            if now - self._opened_at < self.reset_timeout:
+                # Open, or half-open with the trial call still in flight
+                return False
+
+            self._opened_at = now
+            if self.state == self.OPEN:
+                self._transition(self.HALF_OPEN)
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.fail_max:
+                self._opened_at = time.monotonic()
+                if self.state != self.OPEN:
+                    self._transition(self.OPEN)
+
+    def _transition(self, state: str):
+        logging.warning(f"Circuit breaker '{self.name}': {self.state} -> {state}")
+        self.state = state
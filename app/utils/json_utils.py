@@ -0,0 +1,37 @@
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+    logging.debug("orjson not installed, falling back to the standard json module")
+
+
+def dumps_context(payload) -> str:
+    """Serialize a session/context payload to a JSON string.
+
+    Uses orjson when available; anything it cannot encode natively
+    (ObjectId, Decimal, ...) is stringified like ``json.dumps(default=str)``.
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            payload,
+            default=str,
+            option=orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        ).decode()
+    return json.dumps(payload, default=str)
+
+
+def dumps_bytes(payload) -> bytes:
+    """Serialize a request payload to UTF-8 JSON bytes for a raw POST body."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode("utf-8")
+
+
+def loads(data):
+    """Parse JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
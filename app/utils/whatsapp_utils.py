@@ -3,10 +3,15 @@ from flask import current_app, jsonify
 import json
 import requests
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 from app.services.korra_chatbot import korra_bot
 from app.services.whatsapp_formatter import whatsapp_formatter
 
+# Document uploads are parsed here so the webhook request returns immediately
+UPLOAD_WORKERS = 4
+_upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="document-upload")
+
 
 def log_http_response(response):
     logging.info(f"Status: {response.status_code}")
@@ -45,6 +50,39 @@ def send_message(data):
         return response
 
 
+def _send_file_response(wa_id, response_text, suggestions):
+    """Format and send the reply to a document upload"""
+    response_text = process_text_for_whatsapp(response_text)
+    
+    if suggestions and len(suggestions) > 0:
+        if len(suggestions) <= 3:
+            data = whatsapp_formatter.create_interactive_message(wa_id, response_text, suggestions)
+        else:
+            list_options = [{"title": suggestion, "description": ""} for suggestion in suggestions[:10]]
+            data = whatsapp_formatter.create_list_message(wa_id, "File Processing", response_text, list_options)
+    else:
+        data = whatsapp_formatter.create_text_message(wa_id, response_text)
+    
+    send_message(data)
+
+
+def _process_document_upload(app, wa_id, media_id, filename):
+    """Process an uploaded document off the webhook request and send the result"""
+    with app.app_context():
+        try:
+            response_text, suggestions = korra_bot.handle_file_upload(wa_id, media_id, filename)
+        except Exception as e:
+            logging.error(f"Error processing document {media_id}: {e}")
+            response_text = "❌ Sorry, I couldn't process your document. Please try uploading again."
+            suggestions = ["🔄 Try Again", "🔙 Main Menu"]
+        
+        # Nothing checks the executor future, so failures must be logged here
+        try:
+            _send_file_response(wa_id, response_text, suggestions)
+        except Exception:
+            logging.exception(f"Error sending document response for {media_id}")
+
+
 def process_text_for_whatsapp(text):
     # Remove brackets and format for WhatsApp
     pattern = r"\【.*?\】"
@@ -95,26 +133,20 @@ def process_whatsapp_message(body):
             
             logging.info(f"Document uploaded: {filename} (ID: {media_id})")
             
-            # Handle document with Korra
             if media_id:
-                response_text, suggestions = korra_bot.handle_file_upload(wa_id, media_id, filename)
+                # Parsing can take a while for large files, so acknowledge now and
+                # send the result from a background worker once it is ready
+                send_message(whatsapp_formatter.create_text_message(
+                    wa_id, "📥 Got your file! I'm processing it now and will reply with the results shortly."
+                ))
+                _upload_executor.submit(
+                    _process_document_upload, current_app._get_current_object(), wa_id, media_id, filename
+                )
             else:
                 response_text = "❌ Sorry, I couldn't process your document. Please try uploading again."
                 suggestions = ["🔄 Try Again", "🔙 Main Menu"]
+                _send_file_response(wa_id, response_text, suggestions)
             
-            # Format and send response
-            response_text = process_text_for_whatsapp(response_text)
-            
-            if suggestions and len(suggestions) > 0:
-                if len(suggestions) <= 3:
-                    data = whatsapp_formatter.create_interactive_message(wa_id, response_text, suggestions)
-                else:
-                    list_options = [{"title": suggestion, "description": ""} for suggestion in suggestions[:10]]
-                    data = whatsapp_formatter.create_list_message(wa_id, "File Processing", response_text, list_options)
-            else:
-                data = whatsapp_formatter.create_text_message(wa_id, response_text)
-            
-            send_message(data)
             return  # Early return for document handling
             
         elif message_data["type"] == "image":